@@ -4,6 +4,7 @@ from app.api.endpoints import json
 from app.api.endpoints import text
 from app.api.endpoints import definition_verification
 from app.api.endpoints import statement_verification
+from app.api.endpoints import metrics
 
 # Create a router to group all endpoints
 api_router = APIRouter()
@@ -14,3 +15,4 @@ api_router.include_router(json.router, prefix="/json", tags=["JSON"])
 api_router.include_router(text.router, prefix="/text", tags=["Text"])
 api_router.include_router(definition_verification.router, prefix="/verification", tags=["Verification"])
 api_router.include_router(statement_verification.router, prefix="/verification", tags=["Verification"])
+api_router.include_router(metrics.router, prefix="/metrics", tags=["Metrics"])
@@ -1,65 +1,156 @@
 from typing import Awaitable, Callable
 from fastapi import WebSocket, WebSocketDisconnect
+import asyncio
+import itertools
 import json
+import logging
+import time
 
+from app.core.utils.cancellation import CancellationToken, RequestCancelled, cancellation_scope
 
-def create_progress_callback(websocket: WebSocket, is_connected: Callable[[], bool]):
+logger = logging.getLogger(__name__)
+
+
+def create_progress_callback(send: Callable[[dict], Awaitable[None]], request_id):
     async def progress_callback(message: str):
-        if is_connected():
-            try:
-                await websocket.send_text(json.dumps({"type": "progress", "message": message}))
-            except RuntimeError:
-                print("WebSocket unexpectedly closed. Stopping progress updates.")
+        await send({"type": "progress", "request_id": request_id, "message": message})
     return progress_callback
 
 
+def create_partial_callback(send: Callable[[dict], Awaitable[None]], request_id, timings: dict):
+    """
+    Create a callback sending partial results of a pipeline as they become available. The time
+    of the first partial result is recorded in timings.
+    """
+    async def partial_callback(kind: str, data: dict):
+        timings.setdefault('first_partial', time.perf_counter())
+        await send({"type": "partial", "request_id": request_id, "kind": kind, "data": data})
+    return partial_callback
+
+
+def report_timings(timings: dict) -> dict:
+    """Compute the time to the first partial result and the total latency of a request."""
+    end = time.perf_counter()
+    first_partial = timings.get('first_partial')
+    report = {
+        "time_to_first_partial": first_partial - timings['start'] if first_partial else None,
+        "total": end - timings['start']
+    }
+    logger.info('Request finished: %s', report)
+    return report
+
+
 async def handle_websocket(
     websocket: WebSocket,
-    process_request: Callable[[dict, Callable[[str], Awaitable[None]]], Awaitable[dict]],
+    process_request: Callable[[dict, Callable[[str], Awaitable[None]],
+                               Callable[[str, dict], Awaitable[None]]], Awaitable[dict]],
+    max_in_flight: int = 4,
 ):
     """
     Handles a WebSocket connection for a generic request-processing workflow.
 
+    Several requests can be in flight per connection. Every message refers to its request by
+    the "request_id" of the request (generated if the request has none). A message
+    {"type": "cancel", "request_id": ...} cancels a request, and all in-flight requests are
+    cancelled when the client disconnects. Cancellation is propagated to the threads of the
+    request with a CancellationToken, so they stop at their next check. Failed requests are
+    reported with an error message and do not end the connection. Requests beyond max_in_flight
+    are rejected with an error message, so a single connection cannot occupy all workers.
+
     Args:
         websocket: The WebSocket connection.
-        process_request: A callback function that takes the request data and a progress callback.
-                         It should return the result of processing.
+        process_request: A callback function that takes the request data, a progress callback and
+                         a callback for partial results. It should return the result of
+                         processing.
+        max_in_flight: Maximum number of requests in flight per connection.
     """
     await websocket.accept()
     is_connected = True
+    send_lock = asyncio.Lock()
+    in_flight: dict = {}  # request id -> (task, token)
+    generated_ids = itertools.count()
+
+    async def send(message: dict):
+        if not is_connected:
+            return
+        async with send_lock:
+            try:
+                await websocket.send_text(json.dumps(message))
+            except RuntimeError:
+                logger.warning("WebSocket unexpectedly closed. Dropping message.")
+
+    async def run(request_id, request: dict, token: CancellationToken):
+        timings = {'start': time.perf_counter()}
+        with cancellation_scope(token):
+            try:
+                result = await process_request(request,
+                                               create_progress_callback(send, request_id),
+                                               create_partial_callback(send, request_id, timings))
+                await send({"type": "result", "request_id": request_id, "data": result,
+                            "timings": report_timings(timings)})
+            except (asyncio.CancelledError, RequestCancelled):
+                await send({"type": "cancelled", "request_id": request_id})
+            except Exception as e:
+                await send({"type": "error", "request_id": request_id, "message": str(e)})
+            finally:
+                in_flight.pop(request_id, None)
+
+    def cancel(request_id) -> bool:
+        if request_id not in in_flight:
+            return False
+        task, token = in_flight[request_id]
+        token.cancel()  # stops the threads of the request at their next check
+        task.cancel()
+        return True
 
     try:
         while True:
             try:
                 data = await websocket.receive_text()
-                request = json.loads(data)
+            except WebSocketDisconnect:
+                logger.info("Client disconnected")
+                is_connected = False
+                break
 
-                progress_callback = create_progress_callback(websocket, lambda: is_connected)
+            try:
+                request = json.loads(data)
+                if not isinstance(request, dict):
+                    raise ValueError("Requests need to be JSON objects.")
+            except ValueError as e:
+                await send({"type": "error", "request_id": None, "message": str(e)})
+                continue
 
-                # Process the request and get the result
-                result = await process_request(request, progress_callback)
+            request_id = request.get("request_id")
+            if request.get("type") == "cancel":
+                if not cancel(request_id):
+                    await send({"type": "error", "request_id": request_id,
+                                "message": "No request with this id is in flight."})
+                continue
 
-                if is_connected:
-                    try:
-                        await websocket.send_text(json.dumps({"type": "result", "data": result}))
-                    except RuntimeError:
-                        print("WebSocket closed during result sending. Exiting.")
-                        break
+            if request_id is None:
+                request_id = f"auto-{next(generated_ids)}"
+            if request_id in in_flight:
+                await send({"type": "error", "request_id": request_id,
+                            "message": "A request with this id is already in flight."})
+                continue
+            if len(in_flight) >= max_in_flight:
+                await send({"type": "error", "request_id": request_id,
+                            "message": f"Too many requests in flight (at most {max_in_flight})."})
+                continue
 
-            except WebSocketDisconnect:
-                print("Client disconnected")
-                is_connected = False
-                break
-            except Exception as e:
-                if is_connected:
-                    await websocket.send_text(json.dumps({"type": "error", "message": str(e)}))
-                break
+            token = CancellationToken()
+            in_flight[request_id] = (asyncio.create_task(run(request_id, request, token)), token)
 
     finally:
+        tasks = [task for task, _ in in_flight.values()]
+        for request_id in list(in_flight):
+            cancel(request_id)
+        await asyncio.gather(*tasks, return_exceptions=True)
+
         if is_connected:
             try:
                 await websocket.close()
             except RuntimeError:
-                print("Attempted to close an already closed WebSocket.")
+                logger.warning("Attempted to close an already closed WebSocket.")
             except Exception as e:
-                print(f"Error while closing WebSocket: {str(e)}")
+                logger.warning("Error while closing WebSocket: %s", e)
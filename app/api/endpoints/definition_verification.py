@@ -1,20 +1,24 @@
+import asyncio
 from typing import Awaitable, Callable
 
 from fastapi import APIRouter, HTTPException
-from langdetect import detect
 from starlette.websockets import WebSocket
 
 from app.api.endpoints.common import handle_websocket
-from app.api.singeltons import def_pipeline
-from app.schemas.definition_verification import VerificationRequest, VerificationResponse
+from app.api.singeltons import def_pipeline, language_identifier
+from app.schemas.definition_verification import (
+    BatchVerificationRequest, BatchVerificationResponse, VerificationRequest, VerificationResponse)
 
 router = APIRouter()
 
 
-async def process_verify_definition(request: dict, progress_callback: Callable[[str], Awaitable[None]]):
-    def_pipeline.set_progress_callback(progress_callback)
-    def_pipeline.lang = 'de' if detect(request["claim"]) == 'de' else 'en'
-    return await def_pipeline.verify(request["word"], request["claim"])
+async def process_verify_definition(request: dict, progress_callback: Callable[[str], Awaitable[None]],
+                                    partial_callback: Callable[[str, dict], Awaitable[None]]):
+    lang, _ = language_identifier.detect(request["claim"])
+    return await def_pipeline.verify(request["word"], request["claim"], lang=lang,
+                                     adaptive=request.get("adaptive", False),
+                                     progress_callback=progress_callback,
+                                     partial_callback=partial_callback)
 
 
 @router.websocket("/verify-definition/ws")
@@ -24,9 +28,23 @@ async def websocket_verify_definition(websocket: WebSocket):
 
 @router.post("/verify-definition", response_model=VerificationResponse)
 async def verify_definition(request: VerificationRequest):
-    def_pipeline.lang = 'de' if detect(request.claim) == 'de' else 'en'
+    lang, _ = language_identifier.detect(request.claim)
     try:
-        result = await def_pipeline.verify(request.word, request.claim)
+        result = await def_pipeline.verify(request.word, request.claim, lang=lang,
+                                           adaptive=request.adaptive)
         return VerificationResponse(**result)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/verify-definition/batch", response_model=BatchVerificationResponse)
+async def verify_definition_batch(request: BatchVerificationRequest):
+    langs = [lang for lang, _ in
+             language_identifier.detect_batch([entry.claim for entry in request.entries])]
+    batch = [{'word': entry.word, 'text': entry.claim} for entry in request.entries]
+    try:
+        results = await asyncio.to_thread(def_pipeline.verify_batch_by_language, batch, langs,
+                                          adaptive=request.adaptive)
+        return BatchVerificationResponse(results=results)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
@@ -0,0 +1,25 @@
+from fastapi import APIRouter
+
+from app.api.singeltons import (language_identifier, lexicon, memory_manager, page_store,
+                                stm_verifier, translation_cache, translator_pool,
+                                wiki_client)
+from app.core.factVerification.pipeline_modules.evidence_fetcher import WikipediaEvidenceFetcher
+from app.core.utils.model_registry import model_registry
+
+router = APIRouter()
+
+
+@router.get("/")
+async def get_metrics():
+    return {
+        "wikipedia": wiki_client.metrics(),
+        "evidence_fetches": WikipediaEvidenceFetcher.single_flight.stats(),
+        "page_store": page_store.stats(),
+        "verifier_cascade": stm_verifier.cascade_stats(),
+        "models": model_registry.stats(),
+        "memory": memory_manager.stats(),
+        "translation_cache": translation_cache.stats(),
+        "word_lexicon": lexicon.stats(),
+        "translators": translator_pool.stats(),
+        "language_identification": language_identifier.stats()
+    }
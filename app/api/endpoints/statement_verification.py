@@ -1,20 +1,24 @@
+import asyncio
 from typing import Awaitable, Callable
 
 from fastapi import APIRouter, HTTPException
-from langdetect import detect
 from starlette.websockets import WebSocket
 
 from app.api.endpoints.common import handle_websocket
-from app.api.singeltons import claim_pipeline
-from app.schemas.statement_verification import VerificationRequest, VerificationResponse
+from app.api.singeltons import claim_pipeline, language_identifier
+from app.schemas.statement_verification import (
+    BatchVerificationRequest, BatchVerificationResponse, VerificationRequest, VerificationResponse)
 
 router = APIRouter()
 
 
-async def process_verify_statement(request: dict, progress_callback: Callable[[str], Awaitable[None]]):
-    claim_pipeline.set_progress_callback(progress_callback)
-    claim_pipeline.lang = 'de' if detect(request["claim"]) == 'de' else 'en'
-    return await claim_pipeline.verify(request["claim"])
+async def process_verify_statement(request: dict, progress_callback: Callable[[str], Awaitable[None]],
+                                   partial_callback: Callable[[str, dict], Awaitable[None]]):
+    lang, _ = language_identifier.detect(request["claim"])
+    return await claim_pipeline.verify(request["claim"], lang=lang,
+                                       adaptive=request.get("adaptive", False),
+                                       progress_callback=progress_callback,
+                                       partial_callback=partial_callback)
 
 
 @router.websocket("/verify-statement/ws")
@@ -24,9 +28,23 @@ async def websocket_endpoint(websocket: WebSocket):
 
 @router.post("/verify-statement", response_model=VerificationResponse)
 async def verify_definition(request: VerificationRequest):
-    claim_pipeline.lang = 'de' if detect(request.claim) == 'de' else 'en'
+    lang, _ = language_identifier.detect(request.claim)
     try:
-        result = await claim_pipeline.verify(request.claim)
+        result = await claim_pipeline.verify(request.claim, lang=lang,
+                                             adaptive=request.adaptive)
         return VerificationResponse(**result)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/verify-statement/batch", response_model=BatchVerificationResponse)
+async def verify_statement_batch(request: BatchVerificationRequest):
+    langs = [lang for lang, _ in
+             language_identifier.detect_batch([entry.claim for entry in request.entries])]
+    batch = [{'text': entry.claim} for entry in request.entries]
+    try:
+        results = await asyncio.to_thread(claim_pipeline.verify_batch_by_language, batch, langs,
+                                          adaptive=request.adaptive)
+        return BatchVerificationResponse(results=results)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
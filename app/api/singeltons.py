@@ -1,37 +1,68 @@
 from app.core.ai.openai_fetcher import OpenAiFetcher
+from app.core.factVerification.fetchers.api_client import ApiClient
+from app.core.factVerification.fetchers.page_store import ProcessedPageStore
+from app.core.factVerification.fetchers.rate_limiter import AdaptiveRateLimiter
+from app.core.factVerification.fetchers.word_lexicon import WordLexicon
 from app.core.factVerification.pipeline_modules.claim_splitter import DisSimSplitter
 from app.core.factVerification.pipeline_modules.evidence_fetcher import WikipediaEvidenceFetcher
 from app.core.factVerification.pipeline_modules.evidence_selector import ModelEvidenceSelector
 from app.core.factVerification.pipeline_modules.sentence_connector import ColonSentenceConnector
 from app.core.factVerification.pipeline_modules.statement_verifier import ModelStatementVerifier
-from app.core.factVerification.pipeline_modules.translator import OpusMTTranslator
+from app.core.factVerification.pipeline_modules.translator import TranslatorPool
 from app.core.factVerification.pipelines.definition_pipeline import DefinitionProgressPipeline
 from app.core.factVerification.pipelines.fact_pipeline import ProgressPipeline
+from app.core.utils.language_identifier import LanguageIdentifier
+from app.core.utils.memory_manager import MemoryManager
+from app.core.utils.translation_cache import TranslationCache
+from config import PROJECT_DIR
 
 openai_fetcher = OpenAiFetcher()
 
+wiki_client = ApiClient(rate_limiter=AdaptiveRateLimiter())
+page_store = ProcessedPageStore(PROJECT_DIR / 'cache' / 'pages', max_bytes=2 * 1024 ** 3)
+
 evid_selector = ModelEvidenceSelector()
 evid_selector.load_model()
 stm_verifier = ModelStatementVerifier()
 stm_verifier.load_model()
 
+# Shared by both pipelines, so each model and tokenizer is only loaded once
+translation_cache = TranslationCache(path=PROJECT_DIR / 'cache' / 'translations.sqlite')
+# Ambiguous claims are treated as english. Claims under 40 letters only need the majority of
+# langdetect's trials (0.5), so short german claims are still translated
+language_identifier = LanguageIdentifier(default_lang='en', min_confidence=0.7,
+                                         short_length=40, short_min_confidence=0.5)
+lexicon = WordLexicon(PROJECT_DIR / 'cache' / 'lexicon_de_en.tsv', source_lang='de')
+# Translation models are loaded per detected language, at most two at a time
+translator_pool = TranslatorPool(max_models=2, cache=translation_cache, lexicons={'de': lexicon})
+evid_fetcher = WikipediaEvidenceFetcher(api_client=wiki_client, page_store=page_store,
+                                        lexicon=lexicon)
+
+# Unloads models that have not been used for 15 minutes, they are reloaded on the next request
+memory_manager = MemoryManager(idle_timeout=900)
+memory_manager.register(evid_selector, 'evidence_selector')
+memory_manager.register(stm_verifier, 'statement_verifier')
+memory_manager.start()
+
 # Initialize the pipeline instance
 def_pipeline = DefinitionProgressPipeline(
-    OpusMTTranslator(),
+    translator_pool,
     ColonSentenceConnector(),
     None,
-    WikipediaEvidenceFetcher(),
+    evid_fetcher,
     evid_selector,
     stm_verifier,
-    'de'
+    'de',
+    memory_manager=memory_manager
 )
 
 # Initialize the pipeline instance
 claim_pipeline = ProgressPipeline(
-    OpusMTTranslator(),
+    translator_pool,
     DisSimSplitter(),
-    WikipediaEvidenceFetcher(),
+    evid_fetcher,
     evid_selector,
     stm_verifier,
-    'de'
+    'de',
+    memory_manager=memory_manager
 )
@@ -0,0 +1,232 @@
+"""Module for resilient http calls to the MediaWiki api."""
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+
+import numpy as np
+from requests import RequestException, Response, Session, Timeout
+
+from app.core.factVerification.fetchers.rate_limiter import AdaptiveRateLimiter
+from app.core.utils.cancellation import check_cancelled, propagate, sleep
+
+
+class ApiClient:
+    """
+    Wrapper around a requests session adding per-call timeouts, retries with jittered backoff
+    and optional hedged requests. A hedged request is a duplicate of a request that has not
+    finished after the observed p95 latency; whichever response arrives first is used.
+    """
+
+    RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+    def __init__(self, session: Session | None = None,
+                 timeout: float | tuple[float, float] = (3.05, 10),
+                 max_retries: int = 2,
+                 backoff_base: float = 0.25,
+                 backoff_max: float = 4.0,
+                 hedge: bool = False,
+                 hedge_quantile: float = 0.95,
+                 hedge_min_samples: int = 20,
+                 latency_window: int = 500,
+                 max_workers: int = 32,
+                 rate_limiter: AdaptiveRateLimiter | None = None,
+                 maxlag: int | None = 5):
+        """
+        Initialize the ApiClient.
+
+        :param session: Session used for the requests. A new one is created if not given.
+        :param timeout: Timeout per call in seconds, either total or (connect, read).
+        :param max_retries: Number of retries after a timeout, connection error, retryable
+        status code (429, 5xx) or maxlag error.
+        :param backoff_base: Base of the exponential backoff between retries in seconds.
+        :param backoff_max: Maximum backoff between retries in seconds.
+        :param hedge: Whether to send hedged requests.
+        :param hedge_quantile: Latency quantile after which a hedged request is sent.
+        :param hedge_min_samples: Number of observed latencies needed before hedging starts.
+        :param latency_window: Number of recent latencies the quantiles are computed on.
+        :param max_workers: Maximum number of threads used for hedged requests.
+        :param rate_limiter: Limiter every request has to pass, shared by all clients that
+        should stay below the same throttling threshold.
+        :param maxlag: Value of the maxlag parameter sent with each request, so the api rejects
+        requests while its replication lag is high instead of slowing down. None disables it.
+        """
+        self.session = session or Session()
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_samples = hedge_min_samples
+        self.max_workers = max_workers
+        self.rate_limiter = rate_limiter
+        self.maxlag = maxlag
+
+        self._latencies = deque(maxlen=latency_window)
+        self._counters = {'requests': 0, 'responses': 0, 'errors': 0, 'timeouts': 0,
+                          'retries': 0, 'hedged': 0, 'hedge_wins': 0}
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def get(self, url: str, params: dict | None = None) -> Response:
+        """
+        Send a GET request, retrying on timeouts, connection errors and retryable status codes.
+
+        :param url: The url to request.
+        :param params: The query parameters.
+        :return: The response. If all retries failed, the last response, or the last exception
+        is raised if there was none.
+        """
+        if self.maxlag is not None:
+            params = {**(params or {}), 'maxlag': self.maxlag}
+
+        attempt = 0
+        while True:
+            check_cancelled()
+            response, error = None, None
+            try:
+                response = self._send(url, params)
+            except Timeout as e:
+                self._count('timeouts')
+                error = e
+            except RequestException as e:
+                self._count('errors')
+                error = e
+
+            if response is not None and not self._should_retry(response):
+                return response
+            if attempt >= self.max_retries:
+                if response is not None:
+                    return response
+                raise error
+
+            attempt += 1
+            self._count('retries')
+            sleep(max(self._backoff(attempt), self._retry_after(response) or 0))
+
+    def _should_retry(self, response: Response) -> bool:
+        return response.status_code in self.RETRY_STATUS_CODES or self._is_throttled(response)
+
+    @staticmethod
+    def _is_throttled(response: Response) -> bool:
+        # maxlag errors are returned with status 200 and the error code in this header
+        return (response.status_code == 429
+                or response.headers.get('MediaWiki-API-Error') == 'maxlag')
+
+    @staticmethod
+    def _retry_after(response: Response | None) -> float | None:
+        if response is None:
+            return None
+        try:
+            return float(response.headers.get('Retry-After'))
+        except (TypeError, ValueError):
+            return None
+
+    def _backoff(self, attempt: int) -> float:
+        """Exponential backoff with full jitter."""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def _send(self, url: str, params: dict | None) -> Response:
+        hedge_delay = self.hedge_delay()
+        if hedge_delay is None:
+            return self._timed_get(url, params)
+
+        # the hedge delay starts once the primary request got its token, time spent waiting
+        # for the rate limiter is not latency of the api
+        if self.rate_limiter:
+            self.rate_limiter.acquire()
+        executor = self._get_executor()
+        timed_get = propagate(self._timed_get)
+        primary = executor.submit(timed_get, url, params, False)
+        done, _ = wait([primary], timeout=hedge_delay)
+        if done or (self.rate_limiter and self.rate_limiter.congested):
+            # no duplicate requests while the limiter is holding requests back
+            return primary.result()
+
+        self._count('hedged')
+        hedged = executor.submit(timed_get, url, params)
+        pending = {primary, hedged}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    response = future.result()
+                except RequestException as e:
+                    error = e
+                    continue
+                if future is hedged:
+                    self._count('hedge_wins')
+                self._discard(pending)
+                return response
+        raise error
+
+    @staticmethod
+    def _discard(futures: set[Future]):
+        """Close the responses of requests that lost the race once they arrive."""
+        for future in futures:
+            future.add_done_callback(
+                lambda f: f.exception() is None and f.result().close())
+
+    def _timed_get(self, url: str, params: dict | None, acquire: bool = True) -> Response:
+        if self.rate_limiter and acquire:
+            self.rate_limiter.acquire()
+        check_cancelled()
+        self._count('requests')
+        start = time.perf_counter()
+        response = self.session.get(url=url, params=params, timeout=self.timeout)
+        with self._lock:
+            self._latencies.append(time.perf_counter() - start)
+            self._counters['responses'] += 1
+
+        if self.rate_limiter:
+            if self._is_throttled(response):
+                self.rate_limiter.on_throttle(self._retry_after(response))
+            else:
+                self.rate_limiter.on_success()
+        return response
+
+    def hedge_delay(self) -> float | None:
+        """
+        Delay after which a hedged request is sent.
+
+        :return: The observed latency at hedge_quantile or None if hedging is disabled or there
+        are not enough observations yet.
+        """
+        if not self.hedge:
+            return None
+        with self._lock:
+            if len(self._latencies) < self.hedge_min_samples:
+                return None
+            latencies = list(self._latencies)
+        return float(np.quantile(latencies, self.hedge_quantile))
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                    thread_name_prefix='api-client')
+            return self._executor
+
+    def _count(self, counter: str):
+        with self._lock:
+            self._counters[counter] += 1
+
+    def metrics(self) -> dict:
+        """
+        Return the request counters and latency quantiles of the recent requests.
+
+        :return: Dictionary with the counters, the p50/p95/p99 latency in milliseconds and the
+        state of the rate limiter.
+        """
+        with self._lock:
+            metrics = dict(self._counters)
+            latencies = list(self._latencies)
+        for name, quantile in (('p50', 0.5), ('p95', 0.95), ('p99', 0.99)):
+            metrics[f'latency_{name}_ms'] = float(np.quantile(latencies, quantile) * 1000) \
+                if latencies else None
+        if self.rate_limiter:
+            metrics['rate_limiter'] = self.rate_limiter.stats()
+        return metrics
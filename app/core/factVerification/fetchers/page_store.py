@@ -0,0 +1,227 @@
+"""Module for storing processed pages on disk."""
+import fcntl
+import json
+import mmap
+import os
+import threading
+import uuid
+import zlib
+from pathlib import Path
+
+
+class ProcessedPageStore:
+    """
+    Append-only on-disk store of processed (cleaned and split) pages, keyed by
+    (title, site, revision, split_level, only_intro). Since the revision is part of the key,
+    entries never become stale and are never updated.
+
+    Each entry is stored as zlib compressed json in a data file that is memory-mapped for
+    reading. An index file maps each key to the offset and length of its entry. Several
+    processes can share a store; appends and compactions are serialized with a file lock.
+
+    If the data file grows beyond max_bytes, the store is compacted: superseded revisions of a
+    page are dropped, and then the oldest entries until the store is down to three quarters of
+    the budget. The compacted entries are written to a new data file, which is named in the
+    first line of the new index, and the index is replaced atomically.
+    """
+
+    DATA_FILE = 'pages.bin'
+    INDEX_FILE = 'index.jsonl'
+    LOCK_FILE = 'store.lock'
+
+    def __init__(self, path: str | Path, max_bytes: int | None = None):
+        """
+        Initialize the ProcessedPageStore.
+
+        :param path: Directory of the store. It is created if it does not exist.
+        :param max_bytes: Budget of the data file. The store is not compacted if not given.
+        """
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.index_path = self.path / self.INDEX_FILE
+        self.lock_path = self.path / self.LOCK_FILE
+        self.index_path.touch()
+        self.lock_path.touch()
+        (self.path / self.DATA_FILE).touch()
+
+        self._lock = threading.Lock()
+        self._index: dict[str, tuple[int, int]] = {}
+        self._index_position = 0
+        self._index_stat = None
+        self.data_path = self.path / self.DATA_FILE
+        self._mmap = None
+        self._mapped_size = 0
+        self.hits = 0
+        self.misses = 0
+        self.compactions = 0
+        self._read_index()
+
+    @staticmethod
+    def make_key(title: str, site: str, revision: int, split_level: str,
+                 only_intro: bool) -> str:
+        """Create the key of a processed page."""
+        return json.dumps([title, site, revision, split_level, only_intro], ensure_ascii=False)
+
+    def get(self, title: str, site: str, revision: int, split_level: str,
+            only_intro: bool) -> dict | None:
+        """
+        Retrieve a processed page.
+
+        :param title: Title of the page.
+        :param site: Site of the page ('wikipedia' or 'wiktionary').
+        :param revision: Revision id of the page.
+        :param split_level: Level at which the text was split.
+        :param only_intro: Whether only the introduction was processed.
+        :return: The processed texts as returned by Wikipedia._split_text or None if not stored.
+        """
+        key = self.make_key(title, site, revision, split_level, only_intro)
+        with self._lock:
+            if key not in self._index:
+                self._read_index()  # might have been added by another process
+            location = self._index.get(key)
+            try:
+                record = self._read(*location) if location is not None else None
+            except FileNotFoundError:  # compacted by another process since the index was read
+                self._reset()
+                self._read_index()
+                record = None
+            if record is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return json.loads(zlib.decompress(record))
+
+    def put(self, title: str, site: str, revision: int, split_level: str, only_intro: bool,
+            texts: dict):
+        """
+        Store a processed page.
+
+        :param title: Title of the page.
+        :param site: Site of the page ('wikipedia' or 'wiktionary').
+        :param revision: Revision id of the page.
+        :param split_level: Level at which the text was split.
+        :param only_intro: Whether only the introduction was processed.
+        :param texts: The processed texts as returned by Wikipedia._split_text.
+        """
+        key = self.make_key(title, site, revision, split_level, only_intro)
+        record = zlib.compress(
+            json.dumps(texts, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+        with self._lock, open(self.lock_path, 'r') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                self._read_index()
+                if key in self._index:
+                    return
+                with open(self.data_path, 'ab') as data_file:
+                    offset = data_file.seek(0, os.SEEK_END)
+                    data_file.write(record)
+                with open(self.index_path, 'a', encoding='utf-8') as index_file:
+                    index_file.write(json.dumps([key, offset, len(record)]) + '\n')
+                self._read_index()
+                if self.max_bytes is not None and offset + len(record) > self.max_bytes:
+                    self._compact()
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read_index(self):
+        """
+        Read the index entries added since the last read. Nothing is read if the size and the
+        modification time of the index are unchanged, and the whole index is read again if it
+        has been replaced by a compaction.
+        """
+        stat = os.stat(self.index_path)
+        if self._index_stat == (stat.st_ino, stat.st_size, stat.st_mtime_ns):
+            return
+        with open(self.index_path, 'r', encoding='utf-8') as index_file:
+            # taken before reading, so entries appended while reading are read the next time
+            stat = os.fstat(index_file.fileno())
+            if self._index_stat is not None and self._index_stat[0] != stat.st_ino:
+                self._reset()
+            index_file.seek(self._index_position)
+            for line in iter(index_file.readline, ''):
+                if not line.endswith('\n'):
+                    break  # entry is still being written
+                entry = json.loads(line)
+                if isinstance(entry, dict):  # header of a compacted index
+                    self.data_path = self.path / entry['data_file']
+                else:
+                    key, offset, length = entry
+                    self._index[key] = (offset, length)
+                self._index_position = index_file.tell()
+        self._index_stat = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+    def _reset(self):
+        """Forget the index and the mapping of a replaced store."""
+        self._index = {}
+        self._index_position = 0
+        self._index_stat = None
+        self.data_path = self.path / self.DATA_FILE
+        if self._mmap is not None:
+            self._mmap.close()
+        self._mmap = None
+        self._mapped_size = 0
+
+    def _compact(self):
+        """
+        Rewrite the store within three quarters of the budget, keeping the latest revision of
+        each page and the most recently added entries. Called with the file lock held.
+        """
+        latest = {}  # (title, site, split_level, only_intro) -> (revision, key)
+        for key in self._index:
+            title, site, revision, split_level, only_intro = json.loads(key)
+            page = (title, site, split_level, only_intro)
+            if page not in latest or revision >= latest[page][0]:
+                latest[page] = (revision, key)
+        kept_keys = {key for _, key in latest.values()}
+
+        budget, kept = self.max_bytes * 3 // 4, []
+        for key in reversed(self._index):  # newest first
+            if key not in kept_keys:
+                continue
+            length = self._index[key][1]
+            if length > budget:
+                break
+            budget -= length
+            kept.append(key)
+
+        data_file_name = f'pages-{uuid.uuid4().hex[:8]}.bin'
+        new_index_path = self.path / f'{self.INDEX_FILE}.tmp'
+        with open(self.path / data_file_name, 'wb') as data_file, \
+                open(new_index_path, 'w', encoding='utf-8') as index_file:
+            index_file.write(json.dumps({'data_file': data_file_name}) + '\n')
+            for key in reversed(kept):
+                record = self._read(*self._index[key])
+                offset = data_file.tell()
+                data_file.write(record)
+                index_file.write(json.dumps([key, offset, len(record)]) + '\n')
+
+        old_data_path = self.data_path
+        os.replace(new_index_path, self.index_path)
+        self._read_index()
+        old_data_path.unlink(missing_ok=True)  # processes that mapped it keep reading it
+        self.compactions += 1
+
+    def _read(self, offset: int, length: int) -> bytes:
+        if offset + length > self._mapped_size:
+            self._remap()
+        return self._mmap[offset:offset + length]
+
+    def _remap(self):
+        if self._mmap is not None:
+            self._mmap.close()
+        with open(self.data_path, 'rb') as data_file:
+            self._mapped_size = os.fstat(data_file.fileno()).st_size
+            self._mmap = mmap.mmap(data_file.fileno(), 0, access=mmap.ACCESS_READ) \
+                if self._mapped_size else None
+
+    def stats(self) -> dict:
+        """
+        Return the number of stored pages and hits/misses.
+
+        :return: Dictionary with the number of entries, the size of the data file, hits, misses
+        and the number of compactions.
+        """
+        with self._lock:
+            return {'entries': len(self._index), 'size_bytes': self.data_path.stat().st_size,
+                    'hits': self.hits, 'misses': self.misses, 'compactions': self.compactions}
@@ -0,0 +1,143 @@
+"""Module for client-side rate limiting of api calls."""
+import threading
+import time
+from collections import deque
+
+from app.core.utils.cancellation import check_cancelled
+
+
+class AdaptiveRateLimiter:
+    """
+    Token bucket whose rate adapts with AIMD (additive increase, multiplicative decrease).
+
+    Every successful request increases the rate slightly, every throttled request (429, maxlag)
+    halves it and remembers the rate at which throttling happened. Once the rate gets close to
+    that ceiling, it is only increased very slowly, so the rate settles just below the
+    throttling threshold instead of oscillating around it. Waiting requests are served in
+    arrival order, so a burst of one verification cannot starve the others.
+    """
+
+    # seconds after which waiting requests check whether they were cancelled
+    CANCEL_POLL_INTERVAL = 0.1
+
+    def __init__(self, rate: float = 10.0,
+                 min_rate: float = 0.5,
+                 max_rate: float = 100.0,
+                 burst: float = 5.0,
+                 increase: float = 1.0,
+                 decrease: float = 0.5,
+                 ceiling_margin: float = 0.9,
+                 ceiling_ttl: float = 300.0):
+        """
+        Initialize the AdaptiveRateLimiter.
+
+        :param rate: Initial rate in requests per second.
+        :param min_rate: Lower bound of the rate.
+        :param max_rate: Upper bound of the rate.
+        :param burst: Maximum number of tokens that can be saved up.
+        :param increase: Additive increase of the rate per second of successful requests.
+        :param decrease: Factor the rate is multiplied with on throttling.
+        :param ceiling_margin: Fraction of the last throttled rate up to which the rate is
+        increased at full speed.
+        :param ceiling_ttl: Seconds without throttling after which the ceiling is forgotten.
+        """
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.burst = burst
+        self.increase = increase
+        self.decrease = decrease
+        self.ceiling_margin = ceiling_margin
+        self.ceiling_ttl = ceiling_ttl
+
+        self.ceiling = None
+        self.tokens = burst
+        self.blocked_until = 0.0
+        self.throttled = 0
+        self._last_refill = time.monotonic()
+        self._last_throttle = 0.0
+        self._queue = deque()
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        """
+        Block until the caller may send a request. Callers are served in arrival order. Raises
+        RequestCancelled if the request of the caller is cancelled while waiting.
+        """
+        ticket = object()
+        with self._condition:
+            self._queue.append(ticket)
+            try:
+                while True:
+                    check_cancelled()
+                    now = time.monotonic()
+                    self._refill(now)
+                    if self._queue[0] is ticket:
+                        if now >= self.blocked_until and self.tokens >= 1:
+                            self.tokens -= 1
+                            return
+                        wait = max(self.blocked_until - now, (1 - self.tokens) / self.rate)
+                        self._condition.wait(timeout=min(wait, self.CANCEL_POLL_INTERVAL))
+                    else:
+                        self._condition.wait(timeout=self.CANCEL_POLL_INTERVAL)
+            finally:
+                self._queue.remove(ticket)
+                self._condition.notify_all()
+
+    @property
+    def congested(self) -> bool:
+        """Whether requests are waiting for a token or all requests are paused."""
+        with self._condition:
+            return bool(self._queue) or time.monotonic() < self.blocked_until
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+    def on_success(self):
+        """Increase the rate after a request that was not throttled."""
+        with self._condition:
+            now = time.monotonic()
+            self._refill(now)
+            if self.ceiling and now - self._last_throttle > self.ceiling_ttl:
+                self.ceiling = None
+
+            increase = self.increase / self.rate  # ~ +increase requests/s per second
+            if self.ceiling and self.rate >= self.ceiling * self.ceiling_margin:
+                increase *= 0.1  # probe the threshold carefully
+            self.rate = min(self.max_rate, self.rate + increase)
+
+    def on_throttle(self, retry_after: float | None = None):
+        """
+        Decrease the rate after a throttled request.
+
+        :param retry_after: Seconds to pause all requests, e.g. from the Retry-After header.
+        """
+        with self._condition:
+            now = time.monotonic()
+            self._refill(now)
+            self.throttled += 1
+            if retry_after:
+                self.blocked_until = max(self.blocked_until, now + retry_after)
+            # requests that were in flight at the same time report the same throttling
+            if now - self._last_throttle > 1 / self.rate:
+                self.ceiling = self.rate
+                self.rate = max(self.min_rate, self.rate * self.decrease)
+                self.tokens = min(self.tokens, 0)
+            self._last_throttle = now
+            self._condition.notify_all()
+
+    def stats(self) -> dict:
+        """
+        Return the current state of the limiter.
+
+        :return: Dictionary with the current rate, ceiling, queue depth and throttle count.
+        """
+        with self._condition:
+            return {
+                'rate': self.rate,
+                'ceiling': self.ceiling,
+                'queue_depth': len(self._queue),
+                'throttled': self.throttled,
+                'blocked_for': max(0.0, self.blocked_until - time.monotonic())
+            }
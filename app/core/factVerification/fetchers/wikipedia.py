@@ -1,14 +1,24 @@
 """Module for making api call to wikipedia."""
 import re
-from typing import Dict, List, Tuple
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterator, List, Tuple
 
-from requests import Response, Session
-from transformers import RobertaTokenizer
+from requests import Response
+from transformers import AutoTokenizer
 
+from app.core.factVerification.fetchers.api_client import ApiClient
+from app.core.factVerification.fetchers.page_store import ProcessedPageStore
 from app.core.factVerification.fetchers.wiktionary_parser import WiktionaryParser
+from app.core.factVerification.fetchers.word_lexicon import WordLexicon
 from app.core.factVerification.general_utils.utils import (
-    generate_case_combinations,
-    remove_duplicate_values, split_into_passages)
+    is_case_combination,
+    rank_docs, remove_duplicate_values, split_into_passages)
+from app.core.utils.cancellation import propagate
+from app.core.utils.model_registry import model_registry
+from app.core.utils.reader import LineReader
 
 from app.core.factVerification.general_utils.spacy_utils import (
     split_into_sentences,
@@ -21,19 +31,57 @@ class Wikipedia:
     USER_AGENT = 'factVerificationBot (lukas@ellngr.com)'
     BASE_URL = "https://{source_lang}.{site}.org/w/api.php"
 
-    def __init__(self, source_lang: str = 'en', user_agent: str = None):
+    def __init__(self, source_lang: str = 'en', user_agent: str = None,
+                 title_index: str | Path | None = None, max_parallel_requests: int = 8,
+                 api_client: ApiClient | None = None,
+                 page_store: ProcessedPageStore | None = None,
+                 lexicon: WordLexicon | None = None):
+        """
+        Initialize the Wikipedia wrapper.
+
+        :param source_lang: Language of the wikis to query.
+        :param user_agent: User agent to send with each request.
+        :param title_index: Optional file with one Wiktionary title per line (e.g. the
+        all-titles-in-ns0 dump). If given, case variants are resolved locally instead of via the
+        api.
+        :param max_parallel_requests: Maximum number of concurrent requests used when fetching
+        full pages, shared by all callers of this instance. 1 disables concurrent fetching.
+        :param api_client: Client used for the requests, e.g. to share timeouts, retries and
+        metrics between instances. A client with default settings is created if not given.
+        :param page_store: Store of processed pages. If given, pages are only cleaned and split
+        once per revision.
+        :param lexicon: Local lexicon consulted before the interlanguage links when translating
+        words. Resolved interlanguage links are added to it.
+        """
         self.USER_AGENT = user_agent or self.USER_AGENT
-        self.session = Session()
+        self.api_client = api_client or ApiClient()
+        self.session = self.api_client.session
         self.session.headers.update({'User-Agent': self.USER_AGENT})
         self.base_url = self.BASE_URL.format(source_lang=source_lang, site='{site}')
-        self.tokenizer = RobertaTokenizer.from_pretrained("roberta-large")
+        self.tokenizer = model_registry.acquire(
+            'tokenizer:roberta-large', lambda: AutoTokenizer.from_pretrained("roberta-large"))
+        self.title_index = self._load_title_index(title_index) if title_index else None
+        self.max_parallel_requests = max_parallel_requests
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        self.page_store = page_store
+        self.lexicon = lexicon
+
+    @staticmethod
+    def _load_title_index(path: str | Path) -> Dict[str, List[str]]:
+        index = defaultdict(list)
+        for title in LineReader().read(path):
+            title = title.strip().replace('_', ' ')
+            if title:
+                index[title.lower()].append(title)
+        return dict(index)
 
     def _get_response(self, params, site: str, source_lang=None) -> Response:
         assert site in {'wikipedia', 'wiktionary'}
         url = self.base_url.format(site=site) if not source_lang else self.BASE_URL.format(
             source_lang=source_lang,
             site=site)
-        return self.session.get(url=url, params=params)
+        return self.api_client.get(url, params=params)
 
     def get_texts(self,
                   word: str, k: int = 20,
@@ -119,6 +167,12 @@ class Wikipedia:
         :return: Dictionary of fetched texts with keys indicating the title and part.
         """
         texts = {}  # dict to get rid of possible duplicates
+        only_intro = 'exintro' in params
+        use_store = self.page_store is not None and not return_raw
+        if use_store:
+            # the revision id identifies the processed page in the store
+            params = {**params, 'prop': f"{params['prop']}|revisions", 'rvprop': 'ids'}
+
         while True:
             response = self._get_response(params, site=site)
             data = response.json()
@@ -129,11 +183,22 @@ class Wikipedia:
                 if title and text:
                     if return_raw:
                         texts.update(self._split_text(title, site, text, split_level='none'))
-                    else:
-                        if site != 'wiktionary':
-                            text = self._clean_text(text)
-                        texts.update(
-                            self._split_text(title, site, text, split_level, sentence_limit))
+                        continue
+
+                    revision = next(iter(page.get('revisions', [])), {}).get('revid')
+                    if use_store and revision:
+                        if (processed := self.page_store.get(title, site, revision, split_level,
+                                                             only_intro)) is not None:
+                            texts.update(processed)
+                            continue
+
+                    if site != 'wiktionary':
+                        text = self._clean_text(text)
+                    processed = self._split_text(title, site, text, split_level, sentence_limit)
+                    if use_store and revision:
+                        self.page_store.put(title, site, revision, split_level, only_intro,
+                                            processed)
+                    texts.update(processed)
             if 'continue' not in data:
                 break
             params.update(data['continue'])
@@ -200,23 +265,94 @@ class Wikipedia:
         (default: False).
         :return: A dictionary with page titles as keys and the corresponding fetched text as values.
         """
-        results = {}
-        # wikipedia api supports a maximum of 50
-        for batch_pages in self._chunk(page_titles, 50):
+        def build_params(titles: List[str]) -> Dict:
             params = {
                 "action": "query",
                 "format": "json",
                 "prop": "extracts",
                 "explaintext": True,
-                "titles": "|".join(batch_pages),
+                "titles": "|".join(titles),
                 "redirects": True  # Follow redirects, e.g. Light bulb to Electric light
             }
             if only_intro:
                 params['exintro'] = "true"
-            results.update(
-                self._fetch_batch(params, site, split_level=split_level, return_raw=return_raw))
+            return params
+
+        if not only_intro and self.max_parallel_requests > 1 and len(page_titles) > 1:
+            # full extracts are returned only a few pages per response, so following the
+            # continuation of one large request is slower than one request per page
+            params_list = [build_params([title]) for title in page_titles]
+        else:
+            # wikipedia api supports a maximum of 50
+            params_list = [build_params(batch_pages)
+                           for batch_pages in self._chunk(page_titles, 50)]
+        return self._fetch_batches(params_list, site, split_level=split_level,
+                                   return_raw=return_raw)
+
+    def _fetch_batches(self, params_list: List[Dict], site: str, split_level: str = 'sentence',
+                       return_raw: bool = False) -> Dict:
+        """
+        Fetch several independent batches, concurrently if there is more than one.
+
+        :param params_list: Parameters for each of the API requests.
+        :param site: Site from which to fetch data ('wikipedia' or 'wiktionary').
+        :param split_level: Level at which to split the text ('passage', 'sentence', 'none').
+        :param return_raw: Whether to return the raw text without cleaning and splitting.
+        :return: Dictionary of fetched texts, merged in the order of params_list.
+        """
+        def fetch(params: Dict) -> Dict:
+            return self._fetch_batch(params, site, split_level=split_level,
+                                     return_raw=return_raw)
+
+        results = {}
+        for batch_result in self._map_concurrently(fetch, params_list):
+            results.update(batch_result)
         return results
 
+    def _map_concurrently(self, fn, items: List) -> List:
+        """
+        Apply fn to all items, keeping the order. The items of all concurrent calls share one
+        executor, so at most max_parallel_requests requests are in flight per instance.
+        """
+        if len(items) <= 1 or self.max_parallel_requests <= 1:
+            return [fn(item) for item in items]
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_parallel_requests,
+                                                    thread_name_prefix='wikipedia')
+        return list(self._executor.map(propagate(fn), items))
+
+    def get_sections(self, title: str, site: str = 'wikipedia',
+                     sentence_limit: int = 250) -> Iterator[Tuple[str, List[str]]]:
+        """
+        Lazily yields the sections following the introduction of a page, split into sentences.
+        The page is only fetched when the first section is consumed, and each section is only
+        cleaned and split when it is consumed. The plain text extracts of the API cannot be
+        requested per section (action=parse&section=N only returns HTML or wikitext, which would
+        need a different cleaning than the introductions), so the whole page is fetched at once.
+        Pages whose sections are never consumed are not fetched at all.
+
+        :param title: Title of the page.
+        :param site: The site to query (default: 'wikipedia').
+        :param sentence_limit: Maximum number of sentences to yield over all sections.
+        :return: Iterator of tuples containing the section heading and its sentences.
+        """
+        raw_texts = self.get_text_from_title([title], site=site, only_intro=False,
+                                             return_raw=True)
+        text = next(iter(raw_texts.values()), '')
+        # the first part is the introduction, followed by alternating headings and section texts
+        parts = re.split(r'^\s*==+\s*(.+?)\s*==+\s*$', text, flags=re.MULTILINE)
+        sentence_count = 0
+        for heading, section_text in zip(parts[1::2], parts[2::2]):
+            section_text = self._clean_text(section_text)
+            if not section_text.strip():
+                continue
+            sentences = split_into_sentences(section_text)[:sentence_limit - sentence_count]
+            sentence_count += len(sentences)
+            yield heading, sentences
+            if sentence_count >= sentence_limit:
+                return
+
     def find_similar_titles(self, search_term, k: int = 1000) -> List[str]:
         """
         Finds and returns titles similar to the given search term using Wikipedia's search
@@ -241,34 +377,154 @@ class Wikipedia:
         ]
         return list(set(similar_titles))
 
-    def get_pages(self, word: str, fallback_word: str = None, word_lang: str = None,
-                  only_intro=True,
-                  split_level='sentence', return_raw=False) -> Tuple[List, any]:
+    def get_short_descriptions(self, titles: List[str], site: str = 'wikipedia') -> Dict[str, str]:
         """
-        Retrieves pages from Wikipedia online for the given word and language.
+        Retrieves the short descriptions (e.g. "American rock band") of the given titles. They are
+        a few bytes per page and therefore a cheap signal to rank titles before fetching extracts.
+
+        :param titles: The titles to retrieve the short descriptions for.
+        :param site: The site to query (default: 'wikipedia').
+        :return: A dictionary mapping each requested title to its description ('' if missing).
+        """
+        def fetch(batch_titles: List[str]) -> Dict[str, str]:
+            params = {
+                "action": "query",
+                "format": "json",
+                "prop": "description",
+                "titles": "|".join(batch_titles),
+                "redirects": True
+            }
+            data = self._get_response(params, site=site).json()
+            query = data.get('query', {})
+            descriptions = {str(page.get('title')): page.get('description', '')
+                            for page in query.get('pages', {}).values()}
+            for mapping in query.get('normalized', []) + query.get('redirects', []):
+                if mapping.get('to') in descriptions:
+                    descriptions[mapping.get('from')] = descriptions[mapping.get('to')]
+            return {title: descriptions.get(title, '') for title in batch_titles}
+
+        results = {}
+        # wikipedia api supports a maximum of 50
+        for batch_result in self._map_concurrently(fetch, list(self._chunk(titles, 50))):
+            results.update(batch_result)
+        return results
+
+    def rank_titles(self, query: str, titles: List[str], k: int,
+                    keep: str | None = None) -> List[str]:
+        """
+        Ranks titles by the similarity of their title text and short description to the query and
+        returns the top k.
+
+        :param query: The text to rank the titles against, e.g. the claim.
+        :param titles: The candidate titles.
+        :param k: The number of titles to return.
+        :param keep: A title that is always kept (e.g. the exact search term).
+        :return: The top k titles, most similar first.
+        """
+        if len(titles) <= k:
+            return titles
+
+        descriptions = self.get_short_descriptions(titles)
+        docs = [re.sub(r'[()]', ' ', f'{title} {descriptions.get(title, "")}').strip()
+                for title in titles]
+        ranked_titles = [titles[i] for i in rank_docs(query, docs, k=len(titles))]
+        if keep in ranked_titles:
+            ranked_titles.remove(keep)
+            ranked_titles.insert(0, keep)
+        return ranked_titles[:k]
+
+    def find_case_variants(self, word: str, site: str = 'wiktionary', k: int = 100,
+                           max_results: int = 500) -> List[str]:
+        """
+        Finds the existing titles that only differ from the given word in the case of the first
+        letter of its words (e.g. apple tree -> Apple tree, apple Tree).
+
+        Uses the local title index if available, otherwise a case-insensitive prefix search,
+        paged with its continuation up to max_results titles. Either way the number of requests
+        does not depend on the number of words in the input. Variants ranked beyond max_results
+        by the prefix search are missed.
+
+        :param word: The word to find the case variants for.
+        :param site: The site to query (default: 'wiktionary').
+        :param k: The number of prefix matches per request (default: 100).
+        :param max_results: The number of prefix matches to inspect at most (default: 500).
+        :return: A list of existing titles, always containing the word itself.
+        """
+        if self.title_index is not None:
+            candidates = self.title_index.get(word.lower(), [])
+        else:
+            candidates = []
+            params = {
+                "action": "query",
+                "format": "json",
+                "list": "prefixsearch",
+                "pssearch": word,
+                "psnamespace": 0,
+                "pslimit": k
+            }
+            while len(candidates) < max_results:
+                data = self._get_response(params, site=site).json()
+                candidates += [page['title']
+                               for page in data.get('query', {}).get('prefixsearch', [])]
+                if 'continue' not in data:
+                    break
+                params = {**params, **data['continue']}  # psoffset of the next page
+
+        variants = [word] + [title for title in candidates if is_case_combination(title, word)]
+        return list(dict.fromkeys(variants))
+
+    def prefetch_pages(self, word: str, word_lang: str = None, split_level='sentence',
+                       return_raw=False) -> dict:
+        """
+        Retrieves the parts of get_pages that only need the word in its original language: its
+        Wiktionary pages and its translation via the lexicon or the interlanguage links. Can run
+        while the word is still being translated by a model.
 
         :param word: The word to retrieve pages for.
-        :param fallback_word: A fallback word in case the original word could not be translated
-        (default: None).
         :param word_lang: The language of the word (default: None).
-        :param only_intro: Whether to retrieve only the introductory section (default: True).
         :param split_level: The level at which to split the text ('sentence', 'passage', 'none').
         :param return_raw: Whether to return raw text without cleaning or splitting
         (default: False).
-        :return: A list of tuples containing page titles and corresponding content.
+        :return: Dictionary with the word, its Wiktionary pages and its translation (None if not
+        found), to be passed to get_pages.
         """
         word = word.lower()  # lower to find all results
         # check word in original language in english dictionary, need full page here
-        case_words = generate_case_combinations(word)  # wiktionary titles are case-sensitive
-        dict_text_word = self.get_text_from_title(case_words,
-                                                  only_intro=False,
-                                                  site='wiktionary',
-                                                  split_level=split_level,
-                                                  return_raw=return_raw)
-        pages = dict_text_word
+        case_words = self.find_case_variants(word)  # wiktionary titles are case-sensitive
+        pages = self.get_text_from_title(case_words,
+                                         only_intro=False,
+                                         site='wiktionary',
+                                         split_level=split_level,
+                                         return_raw=return_raw)
+        translated_word = self.lookup_translation(word, word_lang) if word_lang != 'en' else None
+        return {'word': word, 'pages': pages, 'translated_word': translated_word}
+
+    def get_candidates(self, word: str, fallback_word: str = None, word_lang: str = None,
+                       split_level='sentence', return_raw=False,
+                       prefetched: dict | None = None) -> dict:
+        """
+        Retrieves the parts of get_pages that do not depend on the query: the Wiktionary pages of
+        the word and of its translation, and the similar Wikipedia titles of the translation.
+
+        :param word: The word to retrieve pages for.
+        :param fallback_word: A fallback word in case the original word could not be translated
+        (default: None).
+        :param word_lang: The language of the word (default: None).
+        :param split_level: The level at which to split the text ('sentence', 'passage', 'none').
+        :param return_raw: Whether to return raw text without cleaning or splitting
+        (default: False).
+        :param prefetched: Result of prefetch_pages for the word with the same word_lang,
+        split_level and return_raw. Fetched here if not given.
+        :return: Dictionary with the (translated) word, the Wiktionary pages and the similar
+        Wikipedia titles.
+        """
+        if prefetched is None:
+            prefetched = self.prefetch_pages(word, word_lang, split_level, return_raw)
+        word = prefetched['word']
+        pages = dict(prefetched['pages'])
 
         if word_lang != 'en':
-            word = self.translate_word(word, fallback_word, word_lang).lower()
+            word = (prefetched['translated_word'] or fallback_word or '').lower()
             assert word, "Word could not be translated and no fallback word provided."
 
             # check translated word in english dictionary, need full page here
@@ -279,27 +535,101 @@ class Wikipedia:
                                                             return_raw=return_raw)
             pages.update(dict_text_translated)
 
+        return {'word': word, 'pages': pages, 'similar_titles': self.find_similar_titles(word)}
+
+    def select_titles(self, candidates: dict, query: str | None = None,
+                      max_pages: int | None = None) -> List[str]:
+        """
+        Selects the Wikipedia titles of the candidates to fetch.
+
+        :param candidates: Result of get_candidates.
+        :param query: Text the pages are later selected for (e.g. the claim). If given together
+        with max_pages, the titles are ranked against it.
+        :param max_pages: Maximum number of Wikipedia pages to fetch (default: None, all).
+        :return: The titles to fetch.
+        """
+        titles = candidates['similar_titles']
+        if titles and query and max_pages:
+            titles = self.rank_titles(query, titles, max_pages, keep=candidates['word'])
+        return titles
+
+    @staticmethod
+    def combine_pages(candidates: dict, wiki_texts: Dict) -> Tuple[List, str]:
+        """
+        Combines the Wiktionary pages of the candidates with the fetched Wikipedia pages.
+
+        :param candidates: Result of get_candidates.
+        :param wiki_texts: The fetched Wikipedia pages of the selected titles.
+        :return: A list of tuples containing page titles and corresponding content, and the word
+        used for the Wikipedia search.
+        """
+        pages = {**candidates['pages'], **wiki_texts}
+        pages = remove_duplicate_values(pages)  # just to be sure no duplicate effort is made.
+        return list(pages.items()), candidates['word']
+
+    def get_pages(self, word: str, fallback_word: str = None, word_lang: str = None,
+                  only_intro=True,
+                  split_level='sentence', return_raw=False,
+                  query: str | None = None, max_pages: int | None = None,
+                  prefetched: dict | None = None) -> Tuple[List, any]:
+        """
+        Retrieves pages from Wikipedia online for the given word and language.
+
+        :param word: The word to retrieve pages for.
+        :param fallback_word: A fallback word in case the original word could not be translated
+        (default: None).
+        :param word_lang: The language of the word (default: None).
+        :param only_intro: Whether to retrieve only the introductory section (default: True).
+        :param split_level: The level at which to split the text ('sentence', 'passage', 'none').
+        :param return_raw: Whether to return raw text without cleaning or splitting
+        (default: False).
+        :param query: Text the pages are later selected for (e.g. the claim). If given together
+        with max_pages, the similar Wikipedia titles are ranked against it before fetching.
+        :param max_pages: Maximum number of Wikipedia pages to fetch (default: None, all).
+        :param prefetched: Result of prefetch_pages for the word with the same word_lang,
+        split_level and return_raw. Fetched here if not given.
+        :return: A list of tuples containing page titles and corresponding content.
+        """
+        candidates = self.get_candidates(word, fallback_word, word_lang, split_level, return_raw,
+                                         prefetched)
+        wiki_texts = {}
         # check normal wikipedia
-        if similar_titles := self.find_similar_titles(word):
-            wiki_texts = self.get_text_from_title(similar_titles,
+        if titles := self.select_titles(candidates, query, max_pages):
+            wiki_texts = self.get_text_from_title(titles,
                                                   only_intro=only_intro,
                                                   split_level=split_level,
                                                   return_raw=return_raw)
-            pages.update(wiki_texts)
-        pages = remove_duplicate_values(pages)  # just to be sure no duplicate effort is made.
-        return list(pages.items()), word
+        return self.combine_pages(candidates, wiki_texts)
 
     def translate_word(self, word: str, fallback_word: str = '', word_lang: str = 'de') -> str:
         """
-        Translates a word into another language using Wikipedia's interlanguage links.
+        Translates a word into another language using the local lexicon or, if the word is not
+        in it, Wikipedia's interlanguage links.
 
         :param word: The word to translate.
         :param fallback_word: A fallback word if no translation is found (default: '').
         :param word_lang: The source language of the word (default: 'de').
         :return: The translated word, or the fallback word if no translation is available.
         """
+        return self.lookup_translation(word, word_lang) or fallback_word
+
+    def lookup_translation(self, word: str, word_lang: str = 'de') -> str | None:
+        """
+        Looks up the english translation of a word in the local lexicon or, if the word is not
+        in it, via Wikipedia's interlanguage links.
+
+        :param word: The word to translate.
+        :param word_lang: The source language of the word (default: 'de').
+        :return: The translated word, or None if no translation is found.
+        """
+        use_lexicon = self.lexicon is not None and self.lexicon.source_lang == word_lang
+        if use_lexicon and (candidates := self.lexicon.lookup(word)):
+            return candidates[0]
+
         interlang_word = self.get_interlanguage_title(word, source_lang=word_lang)
-        return interlang_word or fallback_word
+        if use_lexicon and interlang_word:
+            self.lexicon.add(word, interlang_word)
+        return interlang_word
 
     def get_interlanguage_title(self, title, site: str = 'wikipedia', source_lang='de',
                                 target_lang="en") -> str | None:
@@ -0,0 +1,89 @@
+"""Module for translating single words with a local lexicon."""
+import threading
+from pathlib import Path
+
+
+class WordLexicon:
+    """
+    Local lexicon mapping words of a source language to english translation candidates.
+
+    The lexicon is a tab separated file with one (word, translation) pair per line, the first
+    pair of a word being its preferred translation. It can be built from Wiktionary translation
+    data (see scripts/word_lexicon.py) and is extended with the interlanguage links resolved at
+    runtime, so each word is only looked up online once.
+    """
+
+    def __init__(self, path: str | Path | None = None, source_lang: str = 'de'):
+        """
+        Initialize the WordLexicon.
+
+        :param path: Lexicon file. Added translations are appended to it. Only kept in memory if
+        not given.
+        :param source_lang: Language of the words.
+        """
+        self.path = Path(path) if path else None
+        self.source_lang = source_lang
+        self._entries: dict[str, list[str]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if self.path and self.path.exists():
+            self._load()
+
+    def _load(self):
+        with open(self.path, 'r', encoding='utf-8') as file:
+            for line in file:
+                word, _, translation = line.rstrip('\n').partition('\t')
+                if word and translation:
+                    self._remember(word, translation)
+
+    def _remember(self, word: str, translation: str) -> bool:
+        candidates = self._entries.setdefault(word.lower(), [])
+        if translation in candidates:
+            return False
+        candidates.append(translation)
+        return True
+
+    def lookup(self, word: str) -> list[str]:
+        """
+        Look up the translations of a word.
+
+        :param word: The word, case-insensitive.
+        :return: The translation candidates, the preferred one first. Empty if unknown.
+        """
+        candidates = self._entries.get(word.lower())
+        with self._lock:
+            if candidates:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return list(candidates) if candidates else []
+
+    def add(self, word: str, translation: str):
+        """
+        Add a translation of a word, e.g. resolved via interlanguage links.
+
+        :param word: The word.
+        :param translation: Its english translation.
+        """
+        if not word or not translation or any(c in word + translation for c in '\t\n'):
+            return
+        with self._lock:
+            if self._remember(word, translation) and self.path:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                with open(self.path, 'a', encoding='utf-8') as file:
+                    file.write(f'{word.lower()}\t{translation}\n')
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        """
+        Return the size and hits/misses of the lexicon.
+
+        :return: Dictionary with the number of words, hits, misses and the hit rate.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'words': len(self._entries), 'hits': self.hits, 'misses': self.misses,
+                    'hit_rate': self.hits / lookups if lookups else None}
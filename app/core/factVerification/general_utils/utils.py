@@ -1,5 +1,7 @@
 import itertools
+import re
 import subprocess
+import zlib
 
 import numpy as np
 from rank_bm25 import BM25Okapi
@@ -30,6 +32,23 @@ def generate_case_combinations(txt: str) -> list[str]:
     return combinations
 
 
+def is_case_combination(title: str, txt: str) -> bool:
+    """
+    Checks whether a title is one of the case combinations of a text, i.e. whether it would be
+    contained in generate_case_combinations(txt), without generating all 2^n combinations.
+
+    :param title: The title to check.
+    :param txt: The input string the combinations are derived from.
+    :return: True if the title only differs from txt in the case of the first letter of its words.
+    """
+    title_words, words = title.split(' '), txt.split()
+    if len(title_words) != len(words):
+        return False
+    return all(title_word and title_word[0].lower() == word[0].lower()
+               and title_word[1:] == word[1:]
+               for title_word, word in zip(title_words, words))
+
+
 def remove_duplicate_values(d: dict):
     """
     Removes duplicate values from a dictionary, keeping only the first occurrence of each value.
@@ -52,34 +71,114 @@ def remove_duplicate_values(d: dict):
     return unique_dict
 
 
+def deduplicate_sentences(evidences: list[dict], threshold: float = 0.8, num_perm: int = 64,
+                          bands: int = 16, shingle_size: int = 3) -> list[dict]:
+    """
+    Removes exact and near-duplicate sentences across evidences, keeping the first occurrence.
+    Exact duplicates are found by their normalized text, near-duplicates by the estimated
+    Jaccard similarity of their word shingles (MinHash with LSH banding).
+
+    :param evidences: Evidences with 'title', 'line_indices' and 'lines'.
+    :param threshold: Estimated Jaccard similarity from which sentences are duplicates.
+    :param num_perm: Number of hash functions of the MinHash signatures.
+    :param bands: Number of LSH bands the signatures are split into to find candidates.
+    :param shingle_size: Number of words per shingle.
+    :return: Evidences without the duplicate lines. 'line_indices' keep the original indices,
+    'num_lines' holds the original number of lines, and 'duplicates' maps a kept line index to
+    the removed duplicates ({'title', 'line_idx'}) it represents.
+    """
+    prime = (1 << 31) - 1
+    rng = np.random.default_rng(0)
+    a = rng.integers(1, prime, size=(num_perm, 1), dtype=np.int64)
+    b = rng.integers(0, prime, size=(num_perm, 1), dtype=np.int64)
+    rows = num_perm // bands
+
+    def signature(words: list[str]) -> np.ndarray:
+        shingles = {' '.join(words[i:i + shingle_size])
+                    for i in range(max(len(words) - shingle_size + 1, 1))}
+        hashes = np.array([zlib.crc32(shingle.encode('utf-8')) & prime for shingle in shingles],
+                          dtype=np.int64)
+        return ((a * hashes + b) % prime).min(axis=1)
+
+    exact_matches = {}
+    buckets = {}
+    kept = []  # (evidence index, line index, signature)
+    deduplicated = []
+    for evidence in evidences:
+        lines = evidence.get('lines')
+        if not isinstance(lines, list) or not all(isinstance(line, str) for line in lines):
+            deduplicated.append(evidence)
+            continue
+
+        evidence_idx = len(deduplicated)
+        line_indices, unique_lines, duplicates = [], [], {}
+        for line_idx, line in zip(evidence['line_indices'], lines):
+            words = re.sub(r'\W+', ' ', line.lower()).split()
+            normalized = ' '.join(words)
+            original = exact_matches.get(normalized)
+            if original is None and words:
+                sig = signature(words)
+                candidates = {kept_idx for band in range(bands)
+                              for kept_idx in buckets.get(
+                                  (band, sig[band * rows:(band + 1) * rows].tobytes()), [])}
+                original = next((kept[kept_idx][:2] for kept_idx in sorted(candidates)
+                                 if np.mean(kept[kept_idx][2] == sig) >= threshold), None)
+
+            if original is None:
+                exact_matches.setdefault(normalized, (evidence_idx, line_idx))
+                if words:
+                    for band in range(bands):
+                        buckets.setdefault((band, sig[band * rows:(band + 1) * rows].tobytes()),
+                                           []).append(len(kept))
+                    kept.append((evidence_idx, line_idx, sig))
+                line_indices.append(line_idx)
+                unique_lines.append(line)
+            else:
+                original_idx, original_line_idx = original
+                owner = duplicates if original_idx == evidence_idx \
+                    else deduplicated[original_idx].setdefault('duplicates', {})
+                owner.setdefault(original_line_idx, []).append(
+                    {'title': evidence['title'], 'line_idx': line_idx})
+
+        deduplicated_evidence = {**evidence, 'line_indices': line_indices,
+                                 'lines': unique_lines,
+                                 'num_lines': evidence.get('num_lines', len(lines))}
+        if duplicates:
+            deduplicated_evidence['duplicates'] = duplicates
+        deduplicated.append(deduplicated_evidence)
+
+    return [evidence for evidence in deduplicated if evidence.get('lines')]
+
+
 def split_into_passages(text: str | list[str], tokenizer, max_length=256) -> list[str]:
     """
-    Splits text into passages of a specified token length using a tokenizer.
+    Splits text into passages of a specified token length using a tokenizer. The tokens of all
+    sentences (including their special tokens) are concatenated and cut every max_length tokens,
+    so a sentence that does not fit into a passage is continued in the next one.
 
     :param text: The input text or list of texts.
-    :param tokenizer: A tokenizer to tokenize the input text.
+    :param tokenizer: A tokenizer to tokenize the input text. A fast tokenizer is recommended,
+    as all sentences are tokenized in one batch.
     :param max_length: The maximum length of each passage in tokens.
     :return: A list of text passages.
     """
     if isinstance(text, str):
         text = [text]
-    passages = [[]]
     for sent in text:
         assert len(sent.strip()) > 0
-        tokens = tokenizer(sent)["input_ids"]
-        max_length = max_length - len(passages[-1])
-        if len(tokens) <= max_length:
-            passages[-1].extend(tokens)
-        else:
-            passages[-1].extend(tokens[:max_length])
-            offset = max_length
-            while offset < len(tokens):
-                passages.append(tokens[offset:offset + max_length])
-                offset += max_length
-
-    psgs = [tokenizer.decode(tokens) for tokens in passages if
-            np.sum([t not in [0, 2] for t in tokens]) > 0]
-    return psgs
+    if not text:
+        return []
+
+    encoded = tokenizer(text)["input_ids"]
+    tokens = np.concatenate([np.asarray(ids, dtype=np.int64) for ids in encoded])
+    starts = np.arange(0, len(tokens), max_length)
+
+    # drop passages consisting only of special tokens
+    content = ~np.isin(tokens, tokenizer.all_special_ids)
+    has_content = np.add.reduceat(content, starts) > 0
+    passages = [passage.tolist() for passage, keep in
+                zip(np.split(tokens, starts[1:]), has_content) if keep]
+    return tokenizer.batch_decode(passages)
 
 
 def rank_docs(query: str, docs: list[str], k=5, get_indices=True) -> list[str] | list[int]:
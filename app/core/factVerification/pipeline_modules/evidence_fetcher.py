@@ -1,8 +1,13 @@
 """Module for Evidence Fetcher."""
 from abc import ABC, abstractmethod
-from typing import Tuple
+from typing import Iterator, Tuple
 
+from app.core.factVerification.fetchers.api_client import ApiClient
+from app.core.factVerification.fetchers.page_store import ProcessedPageStore
 from app.core.factVerification.fetchers.wikipedia import Wikipedia
+from app.core.factVerification.fetchers.word_lexicon import WordLexicon
+from app.core.factVerification.general_utils.utils import deduplicate_sentences
+from app.core.utils.single_flight import SingleFlight
 
 
 class EvidenceFetcher(ABC):
@@ -45,12 +50,33 @@ class EvidenceFetcher(ABC):
         """
         Fetch evidences for a batch of words.
 
-        :param batch: list of dictionaries containing 'word' and 'translated_word'.
+        :param batch: list of dictionaries containing 'word' and 'translated_word', and optionally
+        the result of prefetch for the word as 'prefetched'.
         :param only_intro: Flag to fetch only the introduction.
         :param word_lang: Language code for the word.
         :return: Tuple of lists: evidence words and evidence details.
         """
 
+    @abstractmethod
+    def fetch_remaining_sections(self, evidences: list[dict]) -> Iterator[dict]:
+        """
+        Lazily fetch the sections that were not part of the (intro-only) evidences.
+
+        :param evidences: Evidences, most relevant first, as returned by fetch_evidences.
+        :return: Iterator of evidences, one per section, in the order of the given evidences.
+        """
+
+    def prefetch(self, word: str, word_lang: str = 'de') -> dict | None:
+        """
+        Fetch what only depends on the untranslated word, e.g. while the word is translated.
+
+        :param word: The word in its original language.
+        :param word_lang: Language code for the word.
+        :return: Data to pass as 'prefetched' in the batch entry of the word. None if there is
+        nothing to prefetch.
+        """
+        return None
+
 
 class WikipediaEvidenceFetcher(EvidenceFetcher):
     """
@@ -59,14 +85,32 @@ class WikipediaEvidenceFetcher(EvidenceFetcher):
 
     OFFLINE_WIKI = 'lukasellinger/wiki_dump_2024-09-27'
 
-    def __init__(self, source_lang: str = 'en', split_level: str = 'sentence'):
+    # shared by all instances to deduplicate fetches of concurrent requests
+    single_flight = SingleFlight()
+
+    def __init__(self, source_lang: str = 'en', split_level: str = 'sentence',
+                 max_pages: int | None = 6, api_client: ApiClient | None = None,
+                 page_store: ProcessedPageStore | None = None, deduplicate: bool = True,
+                 lexicon: WordLexicon | None = None):
         """
         Initialize the WikipediaEvidenceFetcher.
 
         :param source_lang: The source language for Wikipedia data.
+        :param max_pages: Maximum number of Wikipedia pages to fetch per word if the batch entry
+        contains the claim ('text') to rank the candidate titles against. The evidence selector
+        only keeps the top 3 pages, so a small margin on top of that suffices. None fetches every
+        similar title.
+        :param api_client: Client used for the Wikipedia requests.
+        :param page_store: Store of processed pages shared with other fetchers.
+        :param deduplicate: Whether to remove exact and near-duplicate sentences across the
+        fetched pages, so they are not embedded repeatedly by the evidence selector.
+        :param lexicon: Local lexicon used to translate words before the interlanguage links.
         """
         self.split_level = split_level
-        self.wiki = Wikipedia(source_lang=source_lang)
+        self.max_pages = max_pages
+        self.deduplicate = deduplicate
+        self.wiki = Wikipedia(source_lang=source_lang, api_client=api_client,
+                              page_store=page_store, lexicon=lexicon)
 
     def fetch_evidences(self,
                         word: str | None = None, translated_word: str | None = None,
@@ -88,30 +132,85 @@ class WikipediaEvidenceFetcher(EvidenceFetcher):
                 assert key in entry and entry[
                     key], f'Key "{key}" is missing or has an invalid value in batch entry: {entry}'
 
-        # Fetch evidences for each entry in the batch
-        evidence_batch = [
-            {
-                'word': wiki_word,
-                'evidences': [
-                    {'title': page, 'line_indices': list(range(len(lines))), 'lines': lines}
-                    for page, lines in texts],
-            }
-            for entry in batch
-            for texts, wiki_word in [self.wiki.get_pages(
-                word=entry.get('word'),
-                fallback_word=entry.get('translated_word'),
-                word_lang=word_lang,
-                only_intro=only_intro,
-                split_level=self.split_level
-            )]
-        ]
+        # Repeated words (e.g. the same entity in several splits of a claim) are fetched once
+        unique_entries = {}
+        for entry in batch:
+            unique_entry = unique_entries.setdefault((entry['word'], entry['translated_word']),
+                                                     {**entry, 'texts': []})
+            if entry.get('text') and entry['text'] not in unique_entry['texts']:
+                unique_entry['texts'].append(entry['text'])
+
+        fetched = {
+            key: self._fetch_pages(word=entry['word'],
+                                   fallback_word=entry['translated_word'],
+                                   query=' '.join(entry['texts']) or None,
+                                   only_intro=only_intro,
+                                   word_lang=word_lang,
+                                   prefetched=entry.get('prefetched'))
+            for key, entry in unique_entries.items()
+        }
 
         # Unpack evidences and words
-        evid_words = [entry['word'] for entry in evidence_batch]
-        evids = [entry['evidences'] for entry in evidence_batch]
+        evid_words = [fetched[(entry['word'], entry['translated_word'])][0] for entry in batch]
+        evids = [fetched[(entry['word'], entry['translated_word'])][1] for entry in batch]
 
         return evid_words, evids
 
+    def _fetch_pages(self, word: str, fallback_word: str, query: str | None, only_intro: bool,
+                     word_lang: str, prefetched: dict | None = None) -> Tuple[str, list[dict]]:
+        """
+        Fetch the evidences for a word. The query-independent work (Wiktionary pages,
+        translation, title search) is shared by all fetches of the word that are in flight at
+        the same time, e.g. concurrent requests with different claims about the same word. The
+        titles are then ranked against the query of each fetch, and identical sets of titles
+        share one extract fetch. The prefetched data does not change the result, so it is not
+        part of the keys.
+
+        :return: Tuple containing the word used for the Wikipedia search and its evidences.
+        """
+        candidates = self.single_flight.do(
+            ('candidates', self.wiki.base_url, word, fallback_word, word_lang, self.split_level),
+            self.wiki.get_candidates, word, fallback_word, word_lang,
+            split_level=self.split_level, prefetched=prefetched)
+
+        wiki_texts = {}
+        if titles := self.wiki.select_titles(candidates, query, self.max_pages):
+            wiki_texts = self.single_flight.do(
+                ('extracts', self.wiki.base_url, tuple(sorted(titles)), only_intro,
+                 self.split_level),
+                self.wiki.get_text_from_title, titles, only_intro=only_intro,
+                split_level=self.split_level)
+        return self._to_evidences(*self.wiki.combine_pages(candidates, wiki_texts))
+
+    def _to_evidences(self, texts: list, wiki_word: str) -> Tuple[str, list[dict]]:
+        evidences = [{'title': page, 'line_indices': list(range(len(lines))), 'lines': lines}
+                     for page, lines in texts]
+        if self.deduplicate:
+            evidences = deduplicate_sentences(evidences)
+        return wiki_word, evidences
+
+    def prefetch(self, word: str, word_lang: str = 'de') -> dict:
+        # shared by concurrent requests about the same word, like the fetches
+        return self.single_flight.do(
+            ('prefetch', self.wiki.base_url, word, word_lang, self.split_level),
+            self.wiki.prefetch_pages, word, word_lang, split_level=self.split_level)
+
+    def fetch_remaining_sections(self, evidences: list[dict],
+                                 sentence_limit: int = 250) -> Iterator[dict]:
+        site_suffix = ' (wikipedia)'  # wiktionary pages are always fetched completely
+        for evidence in evidences:
+            if self.split_level != 'sentence' or not evidence['title'].endswith(site_suffix):
+                continue
+            offset = evidence.get('num_lines', len(evidence['line_indices']))
+            if offset >= sentence_limit:
+                continue
+            for _, lines in self.wiki.get_sections(evidence['title'][:-len(site_suffix)],
+                                                   sentence_limit=sentence_limit - offset):
+                yield {'title': evidence['title'],
+                       'line_indices': list(range(offset, offset + len(lines))),
+                       'lines': lines}
+                offset += len(lines)
+
 
 if __name__ == "__main__":
     fetcher = WikipediaEvidenceFetcher()
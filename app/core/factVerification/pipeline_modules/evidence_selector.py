@@ -1,6 +1,7 @@
 """Module for Evidence Selector."""
+import threading
 from abc import ABC, abstractmethod
-from typing import Tuple
+from typing import Callable, Iterable, Tuple
 
 import numpy as np
 import torch
@@ -9,6 +10,8 @@ from transformers import AutoTokenizer
 import onnxruntime as ort
 
 from app.core.factVerification.general_utils.utils import rank_docs
+from app.core.utils.cancellation import check_cancelled
+from app.core.utils.model_registry import model_registry
 from config import PROJECT_DIR, options
 
 
@@ -65,6 +68,25 @@ class EvidenceSelector(ABC):
         :return: list of selected evidences for each claim.
         """
 
+    @abstractmethod
+    def select_evidences_incrementally(self, claim: dict, evidences: list[dict],
+                                       remaining_sections: Callable[[list[dict]], Iterable[dict]],
+                                       max_evidence_count: int = 3,
+                                       top_k: int = 3) -> list[dict]:
+        """
+        Select evidences for a single claim, expanding the evidences only if needed. If no
+        sentence of the given evidences is selected, the remaining sections of the best-ranked
+        evidences are requested one at a time until a section yields a selection.
+
+        :param claim: dictionary representing the claim.
+        :param evidences: list of (intro-only) evidence dictionaries.
+        :param remaining_sections: Callable returning the remaining sections of the given
+        evidences, e.g. EvidenceFetcher.fetch_remaining_sections.
+        :param max_evidence_count: Maximum number of evidences to consider for the claim.
+        :param top_k: Number of top sentences to select for the claim.
+        :return: list of selected evidences for the given claim.
+        """
+
 
 class ModelEvidenceSelector(EvidenceSelector):
     """
@@ -75,17 +97,27 @@ class ModelEvidenceSelector(EvidenceSelector):
     MODEL_ONNX = 'evidence_selection_model.onnx'
 
     def __init__(self,
-                 model_name: str = '', min_similarity: float = 0.5, evidence_selection: str = 'top'):
+                 model_name: str = '', min_similarity: float = 0.5, evidence_selection: str = 'top',
+                 prefilter_top_n: int | None = None, window_length: int = 512):
         """
         Initialize the ModelEvidenceSelector with the specified model.
 
         :param model_name: Name of the model to use. Defaults to a pre-defined model.
+        :param prefilter_top_n: If set, the sentences of the ranked evidences are first scored
+        with BM25 against the claim and only the top n are embedded by the model. Off by default
+        until its recall has been measured with scripts/evaluate_prefilter.py.
+        :param window_length: Maximum number of tokens per window. The sentences of a page are
+        packed into windows of this length, which are embedded as one batch.
         """
         self.model_name = model_name or self.MODEL_NAME
         self.min_similarity = min_similarity
         self.evidence_selection = evidence_selection
-        self.tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+        self.prefilter_top_n = prefilter_top_n
+        self.window_length = window_length
+        self.tokenizer = model_registry.acquire(
+            f'tokenizer:{self.model_name}', lambda: AutoTokenizer.from_pretrained(self.model_name))
         self.model = None
+        self._load_lock = threading.Lock()  # claims can be selected for concurrently
 
     def set_min_similarity(self, min_similarity: float):
         self.min_similarity = min_similarity
@@ -97,15 +129,25 @@ class ModelEvidenceSelector(EvidenceSelector):
 
     def load_model(self):
         """Load the machine learning model for evidence selection, if not already loaded."""
-        if self.model is None:
-            self.model = ort.InferenceSession(f"{PROJECT_DIR}/onnx_models/{self.MODEL_ONNX}", options)
+        with self._load_lock:
+            if self.model is None:
+                self.model = model_registry.acquire(
+                    f'onnx:{self.MODEL_ONNX}',
+                    lambda: ort.InferenceSession(f"{PROJECT_DIR}/onnx_models/{self.MODEL_ONNX}",
+                                                 options))
 
     def unload_model(self):
         """Unload the machine learning model and free up GPU resources."""
-        if self.model is not None:
-            del self.model
-            torch.cuda.empty_cache()
-            self.model = None
+        with self._load_lock:
+            if self.model is not None:
+                self.model = None
+                model_registry.release(f'onnx:{self.MODEL_ONNX}')
+                torch.cuda.empty_cache()
+
+    @property
+    def is_loaded(self) -> bool:
+        """Whether the model is loaded."""
+        return self.model is not None
 
     def select_evidences(self, claim: dict, evidences: list[dict]) -> list[dict]:
         return self.select_evidences_batch([claim], [evidences])[0]
@@ -120,6 +162,28 @@ class ModelEvidenceSelector(EvidenceSelector):
         top_sentences_batch = self._select_top_sentences(batch, ranked_evidence_batch, top_k)
         return top_sentences_batch
 
+    def select_evidences_incrementally(self, claim: dict, evidences: list[dict],
+                                       remaining_sections: Callable[[list[dict]], Iterable[dict]],
+                                       max_evidence_count: int = 3,
+                                       top_k: int = 3) -> list[dict]:
+        if not self.model:
+            self.load_model()
+
+        ranked_evidences = self._rank_evidences([claim], [evidences], max_evidence_count)[0]
+        statement_embeddings = self._embed_claim(claim['text'])
+        top_sentences = self._select_top_sentences_for_claim(claim['text'], statement_embeddings,
+                                                             ranked_evidences, top_k)
+        if top_sentences:
+            return top_sentences
+
+        for section in remaining_sections(ranked_evidences):
+            top_sentences = self._select_top_sentences_for_claim(claim['text'],
+                                                                 statement_embeddings, [section],
+                                                                 top_k)
+            if top_sentences:
+                break
+        return top_sentences
+
     def _rank_evidences(self, batch: list[dict], evidence_batch: list[list[dict]],
                         max_evidence_count: int) -> list[list[dict]]:
         ranked_evidence_batch = []
@@ -183,56 +247,112 @@ class ModelEvidenceSelector(EvidenceSelector):
                               top_k: int) -> list[list[dict]]:
         top_sentences_batch = []
         for claim, evidences in zip(batch, ranked_evidence_batch):
-            statement_model_input = self.tokenizer(claim['text'], return_tensors='pt')
-            onnx_inputs = {
-                'input_ids': statement_model_input['input_ids'].numpy(),
-                'attention_mask': statement_model_input['attention_mask'].numpy(),
-                'sentence_mask': statement_model_input['attention_mask'].unsqueeze(dim=1).numpy()  # If sentence_mask is not required, pass None
-            }
-            with torch.no_grad():
-                statement_embeddings = torch.tensor(self.model.run(None, onnx_inputs)[0])
-            sentence_similarities = []
-
-            for entry in evidences:
-                sentence_similarities.extend(
-                    self._compute_sentence_similarities(entry['title'], entry['line_indices'],
-                                                        entry['lines'], statement_embeddings))
-
-            filtered_sentences = filter(lambda x: x['sim'] > self.min_similarity,
-                                        sentence_similarities)
-            sorted_sentences = sorted(filtered_sentences, key=lambda x: x['sim'], reverse=True)
-            if self.evidence_selection == 'mmr':
-                top_sentences = self.mmr(sorted_sentences, top_k)
-            elif self.evidence_selection == 'top':
-                top_sentences = self.get_top_unique_sentences(sorted_sentences, top_k)
-            else:
-                raise ValueError('evidence_selection must either be "mmr" or "top"')
-
-            for entry in top_sentences:
-                entry.pop('embedding', None)
-            top_sentences_batch.append(top_sentences)
+            statement_embeddings = self._embed_claim(claim['text'])
+            top_sentences_batch.append(
+                self._select_top_sentences_for_claim(claim['text'], statement_embeddings,
+                                                     evidences, top_k))
         return top_sentences_batch
 
+    def _embed_claim(self, text: str) -> torch.Tensor:
+        statement_model_input = self.tokenizer(text, return_tensors='pt')
+        onnx_inputs = {
+            'input_ids': statement_model_input['input_ids'].numpy(),
+            'attention_mask': statement_model_input['attention_mask'].numpy(),
+            'sentence_mask': statement_model_input['attention_mask'].unsqueeze(dim=1).numpy()  # If sentence_mask is not required, pass None
+        }
+        with torch.no_grad():
+            return torch.tensor(self.model.run(None, onnx_inputs)[0])
+
+    def prefilter_evidences(self, claim_text: str, evidences: list[dict],
+                            top_n: int) -> list[dict]:
+        """
+        Keep only the top_n sentences of the evidences with the highest BM25 score for the claim.
+
+        :param claim_text: The claim.
+        :param evidences: list of evidence dictionaries.
+        :param top_n: Number of sentences to keep over all evidences.
+        :return: The evidences with only the kept lines, evidences without lines are removed.
+        """
+        sentences = [(evidence_idx, line_pos)
+                     for evidence_idx, evidence in enumerate(evidences)
+                     for line_pos in range(len(evidence['lines']))]
+        if len(sentences) <= top_n:
+            return evidences
+
+        ranked = rank_docs(claim_text, [evidences[evidence_idx]['lines'][line_pos]
+                                        for evidence_idx, line_pos in sentences], k=top_n)
+        kept = sorted(sentences[i] for i in ranked)  # keep the order within each page
+
+        filtered_evidences = []
+        for evidence_idx, evidence in enumerate(evidences):
+            positions = [line_pos for idx, line_pos in kept if idx == evidence_idx]
+            if positions:
+                filtered_evidences.append({
+                    **evidence,
+                    'line_indices': [evidence['line_indices'][pos] for pos in positions],
+                    'lines': [evidence['lines'][pos] for pos in positions]
+                })
+        return filtered_evidences
+
+    def _select_top_sentences_for_claim(self, claim_text: str,
+                                        statement_embeddings: torch.Tensor,
+                                        evidences: list[dict], top_k: int) -> list[dict]:
+        if self.prefilter_top_n:
+            evidences = self.prefilter_evidences(claim_text, evidences, self.prefilter_top_n)
+
+        sentence_similarities = []
+        for entry in evidences:
+            sentence_similarities.extend(
+                self._compute_sentence_similarities(entry['title'], entry['line_indices'],
+                                                    entry['lines'], statement_embeddings,
+                                                    entry.get('duplicates')))
+
+        filtered_sentences = filter(lambda x: x['sim'] > self.min_similarity,
+                                    sentence_similarities)
+        sorted_sentences = sorted(filtered_sentences, key=lambda x: x['sim'], reverse=True)
+        if self.evidence_selection == 'mmr':
+            top_sentences = self.mmr(sorted_sentences, top_k)
+        elif self.evidence_selection == 'top':
+            top_sentences = self.get_top_unique_sentences(sorted_sentences, top_k)
+        else:
+            raise ValueError('evidence_selection must either be "mmr" or "top"')
+
+        for entry in top_sentences:
+            entry.pop('embedding', None)
+        return top_sentences
+
     def _compute_sentence_similarities(self,
                                        page: str, line_numbers: list[str], sentences: list[str],
-                                       statement_embeddings: torch.Tensor) -> list[dict]:
+                                       statement_embeddings: torch.Tensor,
+                                       duplicates: dict | None = None) -> list[dict]:
+        check_cancelled()
         if sentences:
-            encoded_sequence, sentence_mask = self._encode_sentences(sentences)
+            input_ids, attention_mask, sentence_mask, positions = self._encode_windows(sentences)
             sentences_model_input = {
-                'input_ids': torch.tensor(encoded_sequence).unsqueeze(0).numpy(),
-                'attention_mask': np.expand_dims(np.ones(len(encoded_sequence), dtype=np.int64), axis=0),  # Ensure int64
-                'sentence_mask': torch.tensor(sentence_mask).unsqueeze(0).numpy(),
+                'input_ids': input_ids,
+                'attention_mask': attention_mask,
+                'sentence_mask': sentence_mask,
             }
             with torch.no_grad():
-                sentence_embeddings = torch.tensor(self.model.run(None, sentences_model_input)[0].squeeze(0))
+                window_embeddings = self.model.run(None, sentences_model_input)[0]
+                # stitch the sentence embeddings of all windows back together
+                windows, window_sentences = zip(*positions)
+                sentence_embeddings = torch.tensor(
+                    window_embeddings[list(windows), list(window_sentences)])
                 claim_similarities = cosine_similarity(statement_embeddings,
                                                        sentence_embeddings, dim=2).tolist()[0]
-            return [{'title': page,
-                     'line_idx': line_num,
-                     'text': sentence,
-                     'sim': sim,
-                     'embedding': embedding} for line_num, sentence, sim, embedding in
-                    zip(line_numbers, sentences, claim_similarities, sentence_embeddings)]
+            similarities = [{'title': page,
+                             'line_idx': line_num,
+                             'text': sentence,
+                             'sim': sim,
+                             'embedding': embedding} for line_num, sentence, sim, embedding in
+                            zip(line_numbers, sentences, claim_similarities, sentence_embeddings)]
+            if duplicates:
+                # report the sentences that were removed as duplicates of this one
+                for entry in similarities:
+                    if entry['line_idx'] in duplicates:
+                        entry['duplicates'] = duplicates[entry['line_idx']]
+            return similarities
         else:
             # sim -1 if there are no lines. Discards the evidence then because of topic modelling.
             return [{'title': page,
@@ -241,19 +361,48 @@ class ModelEvidenceSelector(EvidenceSelector):
                      'sim': -1,
                      'embedding': None}]
 
-    def _encode_sentences(self, sentences: list[str]) -> Tuple[list[int], list[list[int]]]:
-        encoded_sequence = []
-        sentence_mask = []
-        for i, sentence in enumerate(sentences):
-            encoded_sentence = self.tokenizer.encode(sentence)[1:-1]
-            encoded_sequence += encoded_sentence
-            sentence_mask += [i] * len(encoded_sentence)
-            encoded_sequence.append(self.tokenizer.sep_token_id)
-            sentence_mask.append(-1)
-        unique_sentence_numbers = set(sentence_mask)
-        sentence_masks = [[1 if val == num else 0 for val in sentence_mask] for num in
-                          unique_sentence_numbers if num != -1]
-        return encoded_sequence, sentence_masks
+    def _encode_windows(self, sentences: list[str]) -> Tuple[np.ndarray, np.ndarray, np.ndarray,
+                                                             list[Tuple[int, int]]]:
+        """
+        Pack the sentences into windows of at most window_length tokens without splitting a
+        sentence. Each sentence is followed by a sep token, sentences longer than a window are
+        truncated.
+
+        :param sentences: Sentences of a page.
+        :return: Padded input_ids and attention_mask of shape (windows, tokens), sentence_mask of
+        shape (windows, sentences per window, tokens) and the (window, sentence) position of each
+        sentence.
+        """
+        encoded_sentences = [ids[:self.window_length - 1] for ids in
+                             self.tokenizer(sentences, add_special_tokens=False)['input_ids']]
+
+        windows = [[]]
+        window_lengths = [0]
+        for i, encoded_sentence in enumerate(encoded_sentences):
+            length = len(encoded_sentence) + 1  # sep token
+            if windows[-1] and window_lengths[-1] + length > self.window_length:
+                windows.append([])
+                window_lengths.append(0)
+            windows[-1].append(i)
+            window_lengths[-1] += length
+
+        shape = (len(windows), max(window_lengths))
+        input_ids = np.full(shape, self.tokenizer.pad_token_id, dtype=np.int64)
+        attention_mask = np.zeros(shape, dtype=np.int64)
+        sentence_mask = np.zeros((shape[0], max(len(window) for window in windows), shape[1]),
+                                 dtype=np.int64)
+        positions = []
+        for window_idx, window in enumerate(windows):
+            offset = 0
+            for sentence_idx, i in enumerate(window):
+                end = offset + len(encoded_sentences[i])
+                input_ids[window_idx, offset:end] = encoded_sentences[i]
+                input_ids[window_idx, end] = self.tokenizer.sep_token_id
+                sentence_mask[window_idx, sentence_idx, offset:end] = 1
+                positions.append((window_idx, sentence_idx))
+                offset = end + 1
+            attention_mask[window_idx, :offset] = 1
+        return input_ids, attention_mask, sentence_mask, positions
 
     @staticmethod
     def get_top_unique_sentences(sorted_sentences: list[dict], top_k: int = 3) -> list[dict]:
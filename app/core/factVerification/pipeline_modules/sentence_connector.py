@@ -1,9 +1,13 @@
 """Module for Sentence Connector."""
+import threading
 from abc import ABC, abstractmethod
 
 import torch
 from transformers import AutoModelForCausalLM, AutoTokenizer, pipeline
 
+from app.core.utils.cancellation import check_cancelled
+from app.core.utils.model_registry import model_registry
+
 
 class SentenceConnector(ABC):
     """Abstract base class for connecting words to their definitions in text."""
@@ -57,6 +61,7 @@ class PhiSentenceConnector(SentenceConnector):
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
         self.pipe = None
         self.use_flash_attn = use_flash_attn
+        self._load_lock = threading.Lock()  # the connector is shared by concurrent requests
 
         self.generation_args = {
             "max_new_tokens": 500,
@@ -67,29 +72,43 @@ class PhiSentenceConnector(SentenceConnector):
 
     def load_model(self):
         """Load the language model for sentence connection."""
-        if self.pipe is None:
-            tokenizer = AutoTokenizer.from_pretrained(self.model_name)
-            attn_impl = "flash_attention_2" if self.use_flash_attn else None
-            model = AutoModelForCausalLM.from_pretrained(
-                self.model_name,
-                torch_dtype="auto",
-                trust_remote_code=True,
-                attn_implementation=attn_impl
-            )
-            model.eval()
-            self.pipe = pipeline(
-                "text-generation",
-                model=model,
-                tokenizer=tokenizer,
-                device=self.device
-            )
+        with self._load_lock:
+            if self.pipe is None:
+                self.pipe = model_registry.acquire(self._registry_name, self._load_pipeline)
+
+    @property
+    def _registry_name(self) -> str:
+        return f'pipeline:{self.model_name}:{self.device}:{self.use_flash_attn}'
+
+    def _load_pipeline(self):
+        tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+        attn_impl = "flash_attention_2" if self.use_flash_attn else None
+        model = AutoModelForCausalLM.from_pretrained(
+            self.model_name,
+            torch_dtype="auto",
+            trust_remote_code=True,
+            attn_implementation=attn_impl
+        )
+        model.eval()
+        return pipeline(
+            "text-generation",
+            model=model,
+            tokenizer=tokenizer,
+            device=self.device
+        )
 
     def unload_model(self):
         """Unload the language model and free up GPU resources."""
-        if self.pipe is not None:
-            del self.pipe
-            torch.cuda.empty_cache()
-            self.pipe = None
+        with self._load_lock:
+            if self.pipe is not None:
+                self.pipe = None
+                model_registry.release(self._registry_name)
+                torch.cuda.empty_cache()
+
+    @property
+    def is_loaded(self) -> bool:
+        """Whether the model is loaded."""
+        return self.pipe is not None
 
     def connect_word_text(self, word: str, text: str) -> str:
         return self.connect_batch([{'word': word, 'text': text}])[0].get('text')
@@ -99,6 +118,7 @@ class PhiSentenceConnector(SentenceConnector):
             self.load_model()
 
         prompts = [self.get_prompt(entry['word'], entry['text']) for entry in batch]
+        check_cancelled()
         outputs = self.pipe(prompts, **self.generation_args)
 
         return [{'text': self.clean_output(entry, output[0]['generated_text'].strip())} for
@@ -1,13 +1,22 @@
 """Module for Statement Verifiers."""
+import logging
+import random
+import re
+import threading
 from abc import ABC, abstractmethod
 from enum import Enum
 
+import numpy as np
 import torch
 from transformers import AutoTokenizer
 import onnxruntime as ort
 
+from app.core.utils.cancellation import check_cancelled
+from app.core.utils.model_registry import model_registry
 from config import PROJECT_DIR, options
 
+logger = logging.getLogger(__name__)
+
 
 class Fact(Enum):
     """Represents the types a fact can have."""
@@ -83,22 +92,97 @@ class StatementVerifier(ABC):
         :return: verification result.
         """
 
+    @abstractmethod
+    def verify_atom(self, atom: str, evidences: list[dict]) -> dict:
+        """
+        Verify a single atomic claim against its selected evidences.
+
+        :param atom: The atomic claim.
+        :param evidences: The selected evidence sentences of the atom.
+        :return: Result of the atom, as in the 'atoms' of verify_splitted_claim.
+        """
+
+    @staticmethod
+    def combine_atom_results(atoms: list[dict]) -> dict:
+        """
+        Aggregate the results of the atoms of a claim, e.g. verified separately with verify_atom.
+
+        :param atoms: Results of the atoms, in the order of the splits.
+        :return: verification result of the claim.
+        """
+        factuality = sum(atom['predicted'] == Fact.SUPPORTED.name for atom in atoms) / len(atoms)
+        return {
+            'predicted': Fact.SUPPORTED.name if factuality == 1 else Fact.NOT_SUPPORTED.name,
+            'factuality': factuality,
+            'atoms': atoms
+        }
+
 
 class ModelStatementVerifier(StatementVerifier):
     """
     StatementVerifier implementation that uses a machine learning model for verification.
+
+    In cascade mode, atoms are first handled by cheap stages: a rule that supports atoms
+    identical to an evidence sentence (up to case and punctuation) and, if configured, a small
+    NLI model whose confident predictions are accepted. Only the remaining atoms escalate to the
+    full model. A sample of the atoms decided by each cheap stage is also verified with the full
+    model to measure its agreement.
     """
 
     MODEL_NAME = 'lukasellinger/claim-verification-model-top_last'
     MODEL_ONNX = 'claim_verification_model.onnx'
-
-    def __init__(self, model_name: str = '', premise_sent_order: str = 'top_last'):
+    CHEAP_STAGES = ('rule', 'cheap_model')
+
+    def __init__(self, model_name: str = '', premise_sent_order: str = 'top_last',
+                 cascade: bool = False,
+                 cheap_model_name: str | None = None,
+                 cheap_model_onnx: str | None = None,
+                 cheap_confidence: float = 0.95,
+                 verbatim_rule: bool = True,
+                 agreement_sample_rate: float = 0.1,
+                 log_interval: int = 100):
+        """
+        Initialize the ModelStatementVerifier.
+
+        :param model_name: Name of the tokenizer of the model.
+        :param premise_sent_order: Order of the premise sentences.
+        :param cascade: Whether to handle confident atoms with the cheap stages.
+        :param cheap_model_name: Name of the tokenizer of the small NLI model. The model needs to
+        use the same labels as the full model (0 = supported).
+        :param cheap_model_onnx: File of the small NLI model in onnx_models/.
+        :param cheap_confidence: Probability from which a prediction of the small model is
+        accepted.
+        :param verbatim_rule: Whether atoms identical to an evidence sentence are supported
+        without running a model. Only exact sentence matches are accepted: an atom contained in a
+        longer sentence can be hedged or attributed by it ("Some believe the earth is flat").
+        :param agreement_sample_rate: Fraction of the atoms decided by the cheap stages that
+        are also verified with the full model to measure the agreement.
+        :param log_interval: Number of cascaded atoms after which the statistics are logged.
+        """
         self.model_name = model_name or self.MODEL_NAME
-        self.tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+        self.tokenizer = model_registry.acquire(
+            f'tokenizer:{self.model_name}', lambda: AutoTokenizer.from_pretrained(self.model_name))
         self.model = None
         self.premise_sent_order = None
         self.set_premise_sent_order(premise_sent_order)
 
+        self.cascade = cascade
+        self.cheap_model_onnx = cheap_model_onnx
+        self.cheap_tokenizer = model_registry.acquire(
+            f'tokenizer:{cheap_model_name}',
+            lambda: AutoTokenizer.from_pretrained(cheap_model_name)) \
+            if cheap_model_name and cheap_model_onnx else None
+        self.cheap_model = None
+        self.cheap_confidence = cheap_confidence
+        self.verbatim_rule = verbatim_rule
+        self.agreement_sample_rate = agreement_sample_rate
+        self.log_interval = log_interval
+        self._stats = {'atoms': 0, 'escalated': 0}
+        for stage in self.CHEAP_STAGES:
+            self._stats.update({stage: 0, f'{stage}_checked': 0, f'{stage}_agreed': 0})
+        self._stats_lock = threading.Lock()
+        self._load_lock = threading.Lock()  # atoms of a claim are verified concurrently
+
     def set_premise_sent_order(self, sent_order: str):
         if sent_order not in {'reverse', 'top_last', 'keep'}:
             raise ValueError(
@@ -107,15 +191,33 @@ class ModelStatementVerifier(StatementVerifier):
 
     def load_model(self):
         """Load the machine learning model for verification, if not already loaded."""
-        if self.model is None:
-            self.model = ort.InferenceSession(f"{PROJECT_DIR}/onnx_models/{self.MODEL_ONNX}", options)
+        with self._load_lock:
+            if self.model is None:
+                self.model = self._acquire_session(self.MODEL_ONNX)
+            if self.cascade and self.cheap_tokenizer and self.cheap_model is None:
+                self.cheap_model = self._acquire_session(self.cheap_model_onnx)
+
+    @staticmethod
+    def _acquire_session(onnx_file: str) -> ort.InferenceSession:
+        return model_registry.acquire(
+            f'onnx:{onnx_file}',
+            lambda: ort.InferenceSession(f"{PROJECT_DIR}/onnx_models/{onnx_file}", options))
 
     def unload_model(self):
         """Unload the machine learning model and free up GPU resources."""
-        if self.model is not None:
-            del self.model
-            torch.cuda.empty_cache()
-            self.model = None
+        with self._load_lock:
+            if self.model is not None:
+                self.model = None
+                model_registry.release(f'onnx:{self.MODEL_ONNX}')
+                torch.cuda.empty_cache()
+            if self.cheap_model is not None:
+                self.cheap_model = None
+                model_registry.release(f'onnx:{self.cheap_model_onnx}')
+
+    @property
+    def is_loaded(self) -> bool:
+        """Whether the model is loaded."""
+        return self.model is not None
 
     def verify_statement(self, statement: dict, evidence: list[dict]):
         return self.verify_statement_batch([statement], [evidence])[0]
@@ -137,31 +239,128 @@ class ModelStatementVerifier(StatementVerifier):
 
         return ' '.join(ordered_sents)
 
-    def verify_statement_batch(self,
-                               statements: list[dict], evids_batch: list[list[dict]]) -> list[dict]:
+    @staticmethod
+    def _run_model(model: ort.InferenceSession, tokenizer, hypotheses: list[str],
+                   facts: list[str]) -> np.ndarray:
+        """Return the class probabilities of a model for each (hypothesis, fact) pair."""
+        check_cancelled()
+        model_inputs = tokenizer(hypotheses, facts, return_tensors='pt', padding=True)
+        with torch.no_grad():
+            onnx_inputs = {
+                'input_ids': model_inputs['input_ids'].numpy(),
+                'attention_mask': model_inputs['attention_mask'].numpy()
+            }
+            logits = torch.tensor(model.run(None, onnx_inputs)[0])
+            return torch.softmax(logits, dim=-1).numpy()
+
+    def _predict(self, hypotheses: list[str], facts: list[str]) -> list[int]:
+        """Predict each (hypothesis, fact) pair with the full model."""
         if not self.model:
             self.load_model()
+        probabilities = self._run_model(self.model, self.tokenizer, hypotheses, facts)
+        return probabilities.argmax(axis=-1).tolist()
+
+    @staticmethod
+    def _normalize(text: str) -> list[str]:
+        return re.findall(r'\w+', text.lower().replace("n't", ' nt'))
+
+    def _is_verbatim(self, fact: str, evidences: list[dict]) -> bool:
+        """Whether the fact is identical to an evidence sentence, up to case and punctuation."""
+        fact_tokens = self._normalize(fact)
+        return bool(fact_tokens) and any(self._normalize(evidence['text']) == fact_tokens
+                                         for evidence in evidences)
 
+    def _classify(self, hypotheses: list[str], facts: list[str],
+                  evidences_batch: list[list[dict]]) -> list[int]:
+        """
+        Predict each (hypothesis, fact) pair, in cascade mode escalating only the pairs the
+        cheap stages are not confident about to the full model.
+
+        :param hypotheses: Premises of the pairs.
+        :param facts: Facts of the pairs.
+        :param evidences_batch: Evidence sentences each premise was built from.
+        :return: Predicted label per pair (0 = supported).
+        """
+        if not self.cascade:
+            return self._predict(hypotheses, facts)
+
+        predictions = [None] * len(facts)
+        decided_by = {}
+        if self.verbatim_rule:
+            for i, (fact, evidences) in enumerate(zip(facts, evidences_batch)):
+                if self._is_verbatim(fact, evidences):
+                    predictions[i] = Fact.SUPPORTED.value
+                    decided_by[i] = 'rule'
+
+        remaining = [i for i, prediction in enumerate(predictions) if prediction is None]
+        if remaining and self.cheap_tokenizer:
+            if self.cheap_model is None:
+                self.load_model()
+            probabilities = self._run_model(self.cheap_model, self.cheap_tokenizer,
+                                            [hypotheses[i] for i in remaining],
+                                            [facts[i] for i in remaining])
+            for i, probs in zip(remaining, probabilities):
+                if probs.max() >= self.cheap_confidence:
+                    predictions[i] = int(probs.argmax())
+                    decided_by[i] = 'cheap_model'
+
+        escalated = [i for i, prediction in enumerate(predictions) if prediction is None]
+        checked = [i for i in decided_by if random.random() < self.agreement_sample_rate]
+        to_predict = escalated + checked
+        full_predictions = dict(zip(to_predict, self._predict(
+            [hypotheses[i] for i in to_predict], [facts[i] for i in to_predict]))) \
+            if to_predict else {}
+        for i in escalated:
+            predictions[i] = full_predictions[i]
+
+        self._update_stats(decided_by, len(escalated),
+                           [(decided_by[i], predictions[i] == full_predictions[i])
+                            for i in checked])
+        return predictions
+
+    def _update_stats(self, decided_by: dict[int, str], escalated: int,
+                      agreements: list[tuple[str, bool]]):
+        with self._stats_lock:
+            before = self._stats['atoms']
+            self._stats['atoms'] += len(decided_by) + escalated
+            for stage in decided_by.values():
+                self._stats[stage] += 1
+            self._stats['escalated'] += escalated
+            for stage, agreed in agreements:
+                self._stats[f'{stage}_checked'] += 1
+                self._stats[f'{stage}_agreed'] += agreed
+            log = before // self.log_interval != self._stats['atoms'] // self.log_interval
+        if log:
+            logger.info('Verifier cascade: %s', self.cascade_stats())
+
+    def cascade_stats(self) -> dict:
+        """
+        Return how the atoms were decided in cascade mode.
+
+        :return: Dictionary with the counts per stage, the escalation rate and, per cheap stage,
+        its agreement with the full model on the sampled atoms.
+        """
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats['escalation_rate'] = stats['escalated'] / stats['atoms'] if stats['atoms'] else None
+        for stage in self.CHEAP_STAGES:
+            checked = stats[f'{stage}_checked']
+            stats[f'{stage}_agreement'] = stats[f'{stage}_agreed'] / checked if checked else None
+        return stats
+
+    def verify_statement_batch(self,
+                               statements: list[dict], evids_batch: list[list[dict]]) -> list[dict]:
         hypothesis_batch = [self._order_hypothesis([sentence['text'] for sentence in entry]) for
                             entry in evids_batch]
         predictions_batch = []
-        for statement, hypothesis in zip(statements, hypothesis_batch):
+        for statement, hypothesis, evids in zip(statements, hypothesis_batch, evids_batch):
             facts = statement.get('splits', [statement.get('text')])
             if not hypothesis:
                 predictions = [Fact.NOT_SUPPORTED.name] * len(facts)
                 factuality = Fact.NOT_SUPPORTED.to_factuality()
             else:
-                model_inputs = self.tokenizer([hypothesis] * len(facts), facts,
-                                              return_tensors='pt', padding=True)
-                with torch.no_grad():
-                    onnx_inputs = {
-                        'input_ids': model_inputs['input_ids'].numpy(),
-                        'attention_mask': model_inputs['attention_mask'].numpy()
-                    }
-                    logits = torch.tensor(self.model.run(None, onnx_inputs)[0])
-                    probabilities = torch.softmax(logits, dim=-1)
-                    predictions = torch.argmax(probabilities, dim=-1).tolist()
-
+                predictions = self._classify([hypothesis] * len(facts), facts,
+                                             [evids] * len(facts))
                 factuality = sum(pred == 0 for pred in predictions) / len(predictions)
                 predictions = [Fact.SUPPORTED.name if pred == 0 else Fact.NOT_SUPPORTED.name for
                                pred in predictions]
@@ -175,40 +374,20 @@ class ModelStatementVerifier(StatementVerifier):
             })
         return predictions_batch
 
+    def verify_atom(self, atom: str, evidences: list[dict]) -> dict:
+        hypothesis = self._order_hypothesis([sentence['text'] for sentence in evidences])
+        if not hypothesis:
+            prediction = Fact.NOT_SUPPORTED.value
+        else:
+            prediction = self._classify([hypothesis], [atom], [evidences])[0]
+        return {'atom': atom,
+                'predicted': Fact.SUPPORTED.name if prediction == 0 else Fact.NOT_SUPPORTED.name,
+                'selected_evids': evidences}
+
     def verify_splitted_claim(self,
                               statement: dict, evids_batch: list[list[dict]]) -> dict:
-        if not self.model:
-            self.load_model()
-
-        hypothesis_batch = [self._order_hypothesis([sentence['text'] for sentence in entry]) for
-                            entry in evids_batch]
-        factualities = []
-        for split, hypothesis, evids in zip(statement['splits'], hypothesis_batch, evids_batch):
-            if not hypothesis:
-                factualities.append({'atom': split,
-                                     'predicted': Fact.NOT_SUPPORTED.name,
-                                     'selected_evids': evids})
-            else:
-                model_inputs = self.tokenizer(hypothesis, split, return_tensors='pt', padding=True)
-                with torch.no_grad():
-                    onnx_inputs = {
-                        'input_ids': model_inputs['input_ids'].numpy(),
-                        'attention_mask': model_inputs['attention_mask'].numpy()
-                    }
-                    logits = torch.tensor(self.model.run(None, onnx_inputs)[0])
-                    probabilities = torch.softmax(logits, dim=-1)
-                    prediction = torch.argmax(probabilities, dim=-1).tolist()[0]
-                    factualities.append({'atom': split,
-                                         'predicted': Fact.SUPPORTED.name if prediction == 0 else Fact.NOT_SUPPORTED.name,
-                                         'selected_evids': evids})
-
-        factuality = sum(pred['predicted'] == Fact.SUPPORTED.name for pred in factualities) / len(
-            factualities)
-        return {
-            'predicted': Fact.SUPPORTED.name if factuality == 1 else Fact.NOT_SUPPORTED.name,
-            'factuality': factuality,
-            'atoms': factualities
-        }
+        return self.combine_atom_results([self.verify_atom(split, evids) for split, evids in
+                                          zip(statement['splits'], evids_batch)])
 
 
 if __name__ == "__main__":
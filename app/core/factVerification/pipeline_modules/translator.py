@@ -1,9 +1,23 @@
 """Module for translators."""
+import logging
+import threading
 from abc import ABC, abstractmethod
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Callable
 
 import torch
+from huggingface_hub.utils import RepositoryNotFoundError
 from transformers import AutoModelForSeq2SeqLM, AutoTokenizer
 
+from app.core.factVerification.fetchers.word_lexicon import WordLexicon
+from app.core.utils.cancellation import check_cancelled
+from app.core.utils.model_registry import model_registry
+from app.core.utils.translation_cache import TranslationCache
+from config import PROJECT_DIR, options
+
+logger = logging.getLogger(__name__)
+
 
 class Translator(ABC):
     """
@@ -24,39 +38,44 @@ class Translator(ABC):
          """
 
     @abstractmethod
-    def translate_word_text_batch(self, batch: list[dict]) -> list[dict]:
+    def translate_word_text_batch(self, batch: list[dict], profile: str = 'word') -> list[dict]:
         """
         Translates a batch of words and their associated texts.
 
         :param batch: A batch of dictionaries, each containing 'word' and 'text'.
+        :param profile: Translation profile, trading quality for latency.
         :return: The translated batch as a list of dictionaries.
         """
 
     @abstractmethod
-    def translate_claim_batch(self, batch: list[dict]) -> list[dict]:
+    def translate_claim_batch(self, batch: list[dict], profile: str = 'claim') -> list[dict]:
         """
         Translates a batch of claims.
 
         :param batch: A batch of dictionaries, each containing 'text'.
+        :param profile: Translation profile, trading quality for latency.
         :return: The translated batch as a list of dictionaries.
         """
 
     @abstractmethod
-    def translate_text(self, text: str) -> str:
+    def translate_text(self, text: str, profile: str = 'claim') -> str:
         """
         Translates a given text.
 
         :param text: The text to translate.
+        :param profile: Translation profile, trading quality for latency.
         :return: The translated text.
         """
 
     @abstractmethod
-    def translate_batch(self, batch: list[str], num_translations: int = 5) -> list[list[str]]:
+    def translate_batch(self, batch: list[str], num_translations: int = 5,
+                        profile: str | None = None) -> list[list[str]]:
         """
         Translates a batch of strings (texts).
 
         :param batch: A list of texts to translate.
         :param num_translations: How many translations to return
+        :param profile: Translation profile. Overrides num_translations if given.
         :return: The translated batch.
         """
 
@@ -64,32 +83,115 @@ class Translator(ABC):
 class OpusMTTranslator(Translator):
     """Helsinki-NLP/opus-mt Translator"""
 
-    def __init__(self, source_lang: str = 'de', dest_lang: str = 'en'):
+    # Generation settings per call site. A claim is translated as a whole and only the best
+    # translation is used. A word has no context to disambiguate it, and several candidates are
+    # needed to find one that keeps the 'word: text' format. Both keep the 20 beams used before
+    # until scripts/benchmark_translation.py --profiles has measured the quality and latency of
+    # fewer beams; 'fast' and 'greedy' are opt-in until then.
+    PROFILES = {
+        'greedy': {'num_beams': 1, 'num_translations': 1},
+        'fast': {'num_beams': 4, 'num_translations': 1},
+        'claim': {'num_beams': 20, 'num_translations': 1},
+        'word': {'num_beams': 20, 'num_translations': 5},
+    }
+
+    def __init__(self, source_lang: str = 'de', dest_lang: str = 'en', backend: str = 'torch',
+                 cache: TranslationCache | None = None, lexicon: WordLexicon | None = None):
+        """
+        Initialize the OpusMTTranslator.
+
+        :param source_lang: Language to translate from.
+        :param dest_lang: Language to translate to.
+        :param backend: 'torch' to run the model with PyTorch or 'onnx' to run the onnx export
+        (encoder and decoder with past key values) with ONNX Runtime. The export is read from
+        onnx_models/opus-mt-{source_lang}-{dest_lang} (see scripts/export_translation_model.py)
+        and created on the fly if it does not exist.
+        :param cache: Cache of translations. The model is only loaded for texts that are not
+        cached.
+        :param lexicon: Local lexicon of the source language. Words found in it are not
+        translated by the model, only their texts are.
+        """
+        if backend not in {'torch', 'onnx'}:
+            raise ValueError("backend needs to be either 'torch' or 'onnx'")
         self.model_name = f'Helsinki-NLP/opus-mt-{source_lang}-{dest_lang}'
-        self.device = "cuda" if torch.cuda.is_available() else "cpu"
-        self.tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+        self.backend = backend
+        self.cache = cache
+        self.lexicon = lexicon
+        self.onnx_path = PROJECT_DIR / 'onnx_models' / f'opus-mt-{source_lang}-{dest_lang}'
+        self.device = "cuda" if torch.cuda.is_available() and backend == 'torch' else "cpu"
+        self.tokenizer = model_registry.acquire(
+            f'tokenizer:{self.model_name}', lambda: AutoTokenizer.from_pretrained(self.model_name))
         self.model = None
+        self._load_lock = threading.Lock()  # translators are shared by concurrent requests
+        # called with the translator before its model is loaded, e.g. to make room for it
+        self.before_load: Callable[['OpusMTTranslator'], None] | None = None
+
+    @property
+    def _registry_name(self) -> str:
+        return f'model:{self.model_name}:{self.backend}:{self.device}'
 
     def load_model(self):
         """Load the machine learning model for translation, if not already loaded."""
-        if self.model is None:
-            self.model = AutoModelForSeq2SeqLM.from_pretrained(self.model_name)
-            self.model.to(self.device)
-            self.model.eval()
+        if self.model is None and self.before_load is not None:
+            self.before_load(self)
+        with self._load_lock:
+            if self.model is None:
+                self.model = model_registry.acquire(self._registry_name, self._load_model)
+
+    def _load_model(self):
+        if self.backend == 'onnx':
+            # imported here, so optimum is only needed for the onnx backend
+            from optimum.onnxruntime import ORTModelForSeq2SeqLM
+            if self.onnx_path.exists():
+                return ORTModelForSeq2SeqLM.from_pretrained(self.onnx_path, use_cache=True,
+                                                            session_options=options)
+            return ORTModelForSeq2SeqLM.from_pretrained(self.model_name, export=True,
+                                                        use_cache=True, session_options=options)
+
+        model = AutoModelForSeq2SeqLM.from_pretrained(self.model_name)
+        model.to(self.device)
+        model.eval()
+        return model
 
     def unload_model(self):
         """Unload the machine learning model and free up GPU resources."""
-        if self.model is not None:
-            del self.model
-            torch.cuda.empty_cache()
-            self.model = None
+        with self._load_lock:
+            if self.model is not None:
+                self.model = None
+                model_registry.release(self._registry_name)
+                torch.cuda.empty_cache()
+
+    @property
+    def is_loaded(self) -> bool:
+        """Whether the model is loaded."""
+        return self.model is not None
 
     def translate_word_text(self, word: str, text: str) -> dict:
         return self.translate_word_text_batch([{'word': word, 'text': text}])[0]
 
-    def translate_word_text_batch(self, batch: list[dict]):
+    def translate_word_text_batch(self, batch: list[dict], profile: str = 'word'):
+        if self.lexicon is None:
+            return self._translate_word_text_batch(batch, profile)
+
+        lexicon_words = [next(iter(self.lexicon.lookup(entry.get('word'))), None)
+                         for entry in batch]
+        known = [i for i, word in enumerate(lexicon_words) if word]
+        unknown = [i for i, word in enumerate(lexicon_words) if not word]
+
+        translated_batch = [None] * len(batch)
+        if known:
+            texts = self.translate_batch([batch[i].get('text') for i in known], profile='claim')
+            for i, text in zip(known, texts):
+                translated_batch[i] = {'word': lexicon_words[i], 'text': text[0]}
+        if unknown:
+            translations = self._translate_word_text_batch([batch[i] for i in unknown], profile)
+            for i, translation in zip(unknown, translations):
+                translated_batch[i] = translation
+        return translated_batch
+
+    def _translate_word_text_batch(self, batch: list[dict], profile: str) -> list[dict]:
         batch_translations = self.translate_batch([f"{entry.get('word')}: {entry.get('text')}"
-                                                   for entry in batch])
+                                                   for entry in batch], profile=profile)
 
         translated_batch, fallback_needed = [], []
         for entry, batch_entry in zip(batch, batch_translations):
@@ -106,10 +208,10 @@ class OpusMTTranslator(Translator):
         if fallback_needed:
             word_index = [entry.get('word') for entry in batch]
             words = [entry.get('word') for entry in fallback_needed]
-            translated_words = self.translate_batch(words)
+            translated_words = self.translate_batch(words, profile='word')
             translated_texts = self.translate_batch([entry.get('text')
                                                      for entry in fallback_needed],
-                                                    num_translations=1)
+                                                    profile='claim')
 
             for word, translated_word, translated_text in zip(words, translated_words,
                                                               translated_texts):
@@ -118,17 +220,46 @@ class OpusMTTranslator(Translator):
 
         return translated_batch
 
-    def translate_claim_batch(self, batch: list[dict]) -> list[dict]:
-        batch_translations = self.translate_batch([f"{entry.get('text')}" for entry in batch], num_translations=1)
+    def translate_claim_batch(self, batch: list[dict], profile: str = 'claim') -> list[dict]:
+        batch_translations = self.translate_batch([f"{entry.get('text')}" for entry in batch],
+                                                  profile=profile)
         return [{'text': translation[0]} for translation in batch_translations]
 
-    def translate_text(self, text: str) -> str:
-        return self.translate_batch([text], num_translations=1)[0][0]
-
-    def translate_batch(self, batch: list[str], num_translations: int = 5) -> list[list[str]]:
+    def translate_text(self, text: str, profile: str = 'claim') -> str:
+        return self.translate_batch([text], profile=profile)[0][0]
+
+    def translate_batch(self, batch: list[str], num_translations: int = 5,
+                        profile: str | None = None) -> list[list[str]]:
+        if profile is None:
+            settings = {'num_beams': 20, 'num_translations': num_translations}
+        elif profile in self.PROFILES:
+            settings = self.PROFILES[profile]
+        else:
+            raise ValueError(f"profile needs to be one of {', '.join(self.PROFILES)}")
+        # keyed by the settings, so translations cached under a profile are not reused after it
+        # changes
+        cache_profile = f"beams_{settings['num_beams']}_top_{settings['num_translations']}"
+
+        if self.cache is None:
+            return self._translate(batch, settings)
+
+        cache_model = f'{self.model_name}:{self.backend}'
+        translations = [self.cache.get(cache_model, text, cache_profile) for text in batch]
+        missing = list(dict.fromkeys(text for text, translation in zip(batch, translations)
+                                     if translation is None))
+        if missing:  # the model is only loaded if something needs to be translated
+            translated = dict(zip(missing, self._translate(missing, settings)))
+            for text, translation in translated.items():
+                self.cache.put(cache_model, text, cache_profile, translation)
+            translations = [translation if translation is not None else translated[text]
+                            for text, translation in zip(batch, translations)]
+        return translations
+
+    def _translate(self, batch: list[str], settings: dict) -> list[list[str]]:
         if not self.model:
             self.load_model()
-        return self.get_top_n_translations(batch, num_translations=num_translations)
+        check_cancelled()
+        return self.get_top_n_translations(batch, **settings)
 
     def get_top_n_translations(self, batch: list[str], num_translations: int = 5,
                                max_length: int = 100, num_beams: int = 20) -> list[list[str]]:
@@ -148,7 +279,7 @@ class OpusMTTranslator(Translator):
             max_length=max_length,
             num_beams=num_beams,
             num_return_sequences=num_translations,
-            early_stopping=True
+            early_stopping=num_beams > 1
         )
 
         translations = self.tokenizer.batch_decode(outputs, skip_special_tokens=True)
@@ -156,6 +287,165 @@ class OpusMTTranslator(Translator):
                 range(0, len(translations), num_translations)]
 
 
+def _is_missing_model(error: BaseException) -> bool:
+    """Whether loading failed because the model does not exist, not e.g. a network error."""
+    while error is not None:
+        if isinstance(error, RepositoryNotFoundError):
+            return True
+        if getattr(getattr(error, 'response', None), 'status_code', None) == 404:
+            return True
+        error = error.__cause__ or error.__context__
+    return False
+
+
+class TranslatorPool:
+    """
+    Pool of OpusMTTranslators into the destination language, created on demand for every source
+    language with an opus-mt model. At most max_models models (and optionally max_memory_bytes)
+    are kept loaded; the least recently used ones are unloaded when another one is needed.
+    Source languages without a model are remembered as unsupported.
+    """
+
+    def __init__(self, dest_lang: str = 'en', max_models: int = 2,
+                 max_memory_bytes: int | None = None,
+                 backend: str = 'torch',
+                 cache: TranslationCache | None = None,
+                 lexicons: dict[str, WordLexicon] | None = None):
+        """
+        Initialize the TranslatorPool.
+
+        :param dest_lang: Language to translate to.
+        :param max_models: Maximum number of loaded models.
+        :param max_memory_bytes: Maximum memory of the loaded models, as measured by the model
+        registry. None only limits the number of models.
+        :param backend: Backend of the translators.
+        :param cache: Translation cache shared by the translators.
+        :param lexicons: Word lexicons per source language.
+        """
+        self.dest_lang = dest_lang
+        self.max_models = max_models
+        self.max_memory_bytes = max_memory_bytes
+        self.backend = backend
+        self.cache = cache
+        self.lexicons = lexicons or {}
+
+        self._lock = threading.Lock()
+        self._translators: OrderedDict[str, OpusMTTranslator] = OrderedDict()
+        self._busy: dict[str, int] = {}
+        self._unsupported: set[str] = set()
+        self.loads = 0
+        self.evictions = 0
+
+    def get(self, source_lang: str) -> OpusMTTranslator | None:
+        """
+        Return the translator of a source language, creating it if needed. Its model is loaded
+        on first use; prefer use() to keep the number of loaded models within the limits.
+
+        :param source_lang: Language to translate from.
+        :return: The translator or None if the language needs no translation or has no model.
+        """
+        if source_lang == self.dest_lang:
+            return None
+        with self._lock:
+            if source_lang in self._unsupported:
+                return None
+            translator = self._translators.get(source_lang)
+            if translator is not None:
+                self._translators.move_to_end(source_lang)
+                return translator
+
+        try:
+            translator = OpusMTTranslator(source_lang, self.dest_lang, backend=self.backend,
+                                          cache=self.cache,
+                                          lexicon=self.lexicons.get(source_lang))
+        except OSError as e:
+            if not _is_missing_model(e):
+                raise  # e.g. the hub is not reachable, the language might be supported
+            logger.info('No translation model for %s-%s', source_lang, self.dest_lang)
+            with self._lock:
+                self._unsupported.add(source_lang)
+            return None
+
+        translator.before_load = self._before_load
+        with self._lock:
+            translator = self._translators.setdefault(source_lang, translator)
+            self._translators.move_to_end(source_lang)
+        return translator
+
+    def _before_load(self, translator: OpusMTTranslator):
+        """Make room for the model of a translator that is about to be loaded."""
+        self._evict(reserve=1)
+
+    @contextmanager
+    def use(self, source_lang: str):
+        """
+        Context in which the translator of a source language can be used without its model
+        being evicted. Other models are only evicted if the model of the translator actually
+        needs to be loaded, not for translations served by the cache or the lexicon.
+
+        :param source_lang: Language to translate from.
+        :return: The translator or None if the language needs no translation or has no model.
+        """
+        translator = self.get(source_lang)
+        if translator is None:
+            yield None
+            return
+
+        with self._lock:
+            self._busy[source_lang] = self._busy.get(source_lang, 0) + 1
+            was_loaded = translator.is_loaded
+        try:
+            yield translator
+        finally:
+            with self._lock:
+                self._busy[source_lang] -= 1
+                if not was_loaded and translator.is_loaded:
+                    self.loads += 1
+                    logger.info('Loaded translation model %s (%.0f MB)', translator.model_name,
+                                self._memory(translator) / 2 ** 20)
+            self._evict()
+
+    @staticmethod
+    def _memory(translator: OpusMTTranslator) -> int:
+        entry = model_registry.stats()['entries'].get(translator._registry_name)
+        return entry['memory_bytes'] if entry else 0
+
+    def _evict(self, reserve: int = 0):
+        """Unload the least recently used idle models until the pool is within its limits."""
+        with self._lock:
+            loaded = [(lang, translator) for lang, translator in self._translators.items()
+                      if translator.is_loaded]
+            memory = sum(self._memory(translator) for _, translator in loaded)
+            for lang, translator in loaded:  # least recently used first
+                over_count = len(loaded) + reserve > self.max_models
+                over_memory = self.max_memory_bytes is not None and \
+                    memory > self.max_memory_bytes
+                if not (over_count or over_memory):
+                    break
+                if self._busy.get(lang):
+                    continue
+                memory -= self._memory(translator)
+                translator.unload_model()
+                loaded = [entry for entry in loaded if entry[0] != lang]
+                self.evictions += 1
+                logger.info('Evicted translation model %s', translator.model_name)
+
+    def stats(self) -> dict:
+        """
+        Return the state of the pool.
+
+        :return: Dictionary with the loaded and available languages, unsupported languages and
+        the number of loads and evictions.
+        """
+        with self._lock:
+            return {'loaded': [lang for lang, translator in self._translators.items()
+                               if translator.is_loaded],
+                    'available': list(self._translators),
+                    'unsupported': sorted(self._unsupported),
+                    'loads': self.loads,
+                    'evictions': self.evictions}
+
+
 if __name__ == "__main__":
     translator = OpusMTTranslator()
     print(translator([
@@ -0,0 +1,87 @@
+from contextlib import nullcontext
+
+from app.core.factVerification.pipeline_modules.translator import TranslatorPool
+from app.core.utils.cancellation import check_cancelled
+
+
+class ComponentsMixin:
+    """
+    Runs the components of a pipeline while their models are kept loaded by the memory manager.
+    Expects the pipeline to have translator, evid_fetcher, evid_selector, memory_manager and
+    verify_batch.
+    """
+
+    def verify_batch_by_language(self, batch: list[dict], langs: list[str],
+                                 only_intro: bool = True, adaptive: bool = False) -> list[dict]:
+        """
+        Verify a batch of claims in several languages, e.g. as identified with
+        LanguageIdentifier.detect_batch. The claims are grouped by language, so each group is
+        translated in one batch.
+
+        :param batch: list of dictionaries as expected by verify_batch.
+        :param langs: Language of each claim.
+        :param only_intro: Flag to indicate if only the introductory section of documents should
+        be considered.
+        :param adaptive: Flag to expand to the remaining sections on demand. Overrides only_intro.
+        :return: list of outputs, in the order of the batch.
+        """
+        groups: dict[str, list[int]] = {}
+        for i, lang in enumerate(langs):
+            groups.setdefault(lang, []).append(i)
+
+        outputs = [None] * len(batch)
+        for lang, indices in groups.items():
+            results = self.verify_batch([batch[i] for i in indices], only_intro=only_intro,
+                                        adaptive=adaptive, lang=lang)
+            for i, result in zip(indices, results):
+                outputs[i] = result
+        return outputs
+
+    def _select_evidences(self, claims: list[dict], evids: list[list[dict]],
+                          adaptive: bool = False) -> list[list[dict]]:
+        """
+        Select the evidences for each claim.
+
+        :param claims: list of claims.
+        :param evids: list of evidence lists corresponding to each claim.
+        :param adaptive: Flag to fetch and select the remaining sections of the best-ranked
+        pages if the given (intro-only) evidences contain no sentence that is similar enough.
+        :return: list of selected evidences for each claim.
+        """
+        check_cancelled()
+        with self._use(self.evid_selector):
+            if not adaptive:
+                return self.evid_selector(claims, evids)
+            return [self.evid_selector.select_evidences_incrementally(
+                claim, evid, self.evid_fetcher.fetch_remaining_sections)
+                for claim, evid in zip(claims, evids)]
+
+    def _use(self, component):
+        """Context in which the model of the component is kept loaded."""
+        return self.memory_manager.use(component) if self.memory_manager else nullcontext()
+
+    def _run(self, component, fn, *args, **kwargs):
+        """Call fn while the model of the component is kept loaded."""
+        check_cancelled()
+        with self._use(component):
+            return fn(*args, **kwargs)
+
+    def _translate(self, lang: str, method: str, *args, **kwargs):
+        """
+        Call a method of the translator for a language while its model is kept loaded.
+
+        :param lang: Language to translate from.
+        :param method: Name of the Translator method.
+        :return: The result or None if there is no translator for the language.
+        """
+        check_cancelled()
+        with self._use_translator(lang) as translator:
+            if translator is None:
+                return None
+            with self._use(translator):
+                return getattr(translator, method)(*args, **kwargs)
+
+    def _use_translator(self, lang: str):
+        if isinstance(self.translator, TranslatorPool):
+            return self.translator.use(lang)
+        return nullcontext(self.translator)
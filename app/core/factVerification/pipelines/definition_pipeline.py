@@ -1,26 +1,41 @@
 import asyncio
+import logging
 from copy import deepcopy
-from typing import Tuple
+from typing import Awaitable, Callable, Tuple
 
 from app.core.factVerification.pipeline_modules.claim_splitter import ClaimSplitter
 from app.core.factVerification.pipeline_modules.evidence_fetcher import EvidenceFetcher
 from app.core.factVerification.pipeline_modules.evidence_selector import EvidenceSelector
 from app.core.factVerification.pipeline_modules.sentence_connector import SentenceConnector
 from app.core.factVerification.pipeline_modules.statement_verifier import StatementVerifier
-from app.core.factVerification.pipeline_modules.translator import Translator
+from app.core.factVerification.pipeline_modules.translator import Translator, TranslatorPool
+from app.core.factVerification.pipelines.base_pipeline import ComponentsMixin
+from app.core.utils.cancellation import RequestCancelled, child_token, propagate
+from app.core.utils.memory_manager import MemoryManager
 
+logger = logging.getLogger(__name__)
 
-class Pipeline:
+
+def _log_failure(task: asyncio.Task):
+    """Log the failure of a background task whose result was not needed anymore."""
+    if task.cancelled():
+        return
+    if (error := task.exception()) is not None and not isinstance(error, RequestCancelled):
+        logger.warning('Background task failed: %r', error)
+
+
+class Pipeline(ComponentsMixin):
     """General Pipeline for fetching evidence, selecting evidence, and verifying claims."""
 
     def __init__(self,
-                 translator: Translator | None,
+                 translator: Translator | TranslatorPool | None,
                  sent_connector: SentenceConnector,
                  claim_splitter: ClaimSplitter | None,
                  evid_fetcher: EvidenceFetcher,
                  evid_selector: EvidenceSelector,
                  stm_verifier: StatementVerifier,
-                 lang: str):
+                 lang: str,
+                 memory_manager: MemoryManager | None = None):
         self.translator = translator
         self.sent_connector = sent_connector
         self.claim_splitter = claim_splitter
@@ -28,42 +43,54 @@ class Pipeline:
         self.evid_selector = evid_selector
         self.stm_verifier = stm_verifier
         self.lang = lang
+        self.memory_manager = memory_manager
 
-    def verify_batch(self, batch: list[dict], only_intro: bool = True) -> list[dict]:
+    def verify_batch(self, batch: list[dict], only_intro: bool = True,
+                     adaptive: bool = False, lang: str | None = None) -> list[dict]:
         """
         Verify a batch of claims by fetching, selecting, and verifying evidence.
 
         :param batch: list of dictionaries containing 'word' and 'text'.
         :param only_intro: Flag to indicate if only the introductory section of documents should
         be considered.
+        :param adaptive: Flag to fetch only the introductions and expand to the remaining
+        sections on demand, only if no sufficiently similar sentence is found. Overrides
+        only_intro.
+        :param lang: Language of the claims. Defaults to the language of the pipeline.
         :return: list of outputs with factuality and selected evidences.
         """
+        only_intro = only_intro or adaptive
+        lang = lang or self.lang
         processed_batch = deepcopy(batch)
 
-        if self.lang != 'en':
-            translation_batch = self.translator(processed_batch)
-            evid_fetcher_input = [{**b, 'translated_word': t.get('word')} for b, t in
-                                  zip(batch, translation_batch)]
+        translation_batch = None
+        if lang != 'en':
+            translation_batch = self._translate(lang, 'translate_word_text_batch', processed_batch,
+                                                profile='word')
+        if translation_batch is not None:
+            evid_fetcher_input = [{**b, 'translated_word': t.get('word'), 'text': t.get('text')}
+                                  for b, t in zip(batch, translation_batch)]
         else:
             translation_batch = processed_batch
             evid_fetcher_input = [{**b, 'translated_word': b.get('word')} for b in batch]
 
-        evid_words, evids = self.evid_fetcher(evid_fetcher_input, word_lang=self.lang,
+        evid_words, evids = self.evid_fetcher(evid_fetcher_input, word_lang=lang,
                                               only_intro=only_intro)
 
-        outputs = []
+        outputs = [None] * len(processed_batch)  # in the order of the batch
+        filtered_indices = []
         filtered_batch = []
         filtered_evids = []
         filtered_translations = []
-        for entry, evid, word, translation in zip(processed_batch, evids, evid_words,
-                                                  translation_batch):
+        for i, (entry, evid, word, translation) in enumerate(zip(processed_batch, evids,
+                                                                 evid_words, translation_batch)):
             if not evid:
-                outputs.append(
-                    {'word': entry.get('word'),
-                     'claim': entry.get('text'),
-                     'predicted': -1,
-                     'in_wiki': 'No'})
+                outputs[i] = {'word': entry.get('word'),
+                              'claim': entry.get('text'),
+                              'predicted': -1,
+                              'in_wiki': 'No'}
             else:
+                filtered_indices.append(i)
                 filtered_batch.append(entry)
                 filtered_evids.append(evid)
                 filtered_translations.append({**translation, 'word': word})
@@ -71,23 +98,27 @@ class Pipeline:
         if not filtered_batch:
             return outputs
 
-        processed_batch = self.sent_connector(filtered_translations)
+        processed_batch = self._run(self.sent_connector, self.sent_connector,
+                                    filtered_translations)
 
         if self.claim_splitter:
             processed_batch = self.claim_splitter([entry['text'] for entry in processed_batch])
 
-        evids_batch = self.evid_selector(processed_batch, filtered_evids)
-        factualities = self.stm_verifier(processed_batch, evids_batch)
+        evids_batch = self._select_evidences(processed_batch, filtered_evids, adaptive)
+        factualities = self._run(self.stm_verifier, self.stm_verifier, processed_batch,
+                                 evids_batch)
 
-        for factuality, evidence, entry in zip(factualities, evids_batch, filtered_batch):
-            outputs.append({'word': entry.get('word'),
-                            'claim': entry.get('text'),
-                            **factuality,
-                            'selected_evidences': evidence,
-                            'in_wiki': 'Yes'})
+        for i, factuality, evidence, entry in zip(filtered_indices, factualities, evids_batch,
+                                                  filtered_batch):
+            outputs[i] = {'word': entry.get('word'),
+                          'claim': entry.get('text'),
+                          **factuality,
+                          'selected_evidences': evidence,
+                          'in_wiki': 'Yes'}
         return outputs
 
-    def verify(self, word: str, claim: str, only_intro: bool = True) -> dict:
+    def verify(self, word: str, claim: str, only_intro: bool = True,
+               adaptive: bool = False, lang: str | None = None) -> dict:
         """
         Verify a single claim.
 
@@ -95,10 +126,15 @@ class Pipeline:
         :param claim: The claim to verify.
         :param only_intro: Flag to indicate if only the introductory section of documents should
         be considered.
+        :param adaptive: Flag to fetch only the introductions and expand to the remaining
+        sections on demand, only if no sufficiently similar sentence is found. Overrides
+        only_intro.
+        :param lang: Language of the claim. Defaults to the language of the pipeline.
         :return: Verification result.
         """
         entry = {'word': word, 'text': claim}
-        return self.verify_batch([entry], only_intro=only_intro)[0]
+        return self.verify_batch([entry], only_intro=only_intro, adaptive=adaptive,
+                                 lang=lang)[0]
 
 
 class DefinitionProgressPipeline(Pipeline):
@@ -109,59 +145,135 @@ class DefinitionProgressPipeline(Pipeline):
     def set_progress_callback(self, callback):
         self.progress_callback = callback
 
-    async def verify(self, word: str, claim: str, only_intro: bool = True):
-        if self.progress_callback:
-            await self.progress_callback("startingVerification")
-
-        if self.translator and self.lang != 'en':
-            if self.progress_callback:
-                await self.progress_callback("translating")
-            translated = await asyncio.to_thread(self.translator, [{'word': word, 'text': claim}])
-            translated = translated[0]
-            translated_word = translated.get('word', word)
-            translated_claim = translated.get('text', claim)
-        else:
-            translated_word = word
-            translated_claim = claim
-
-        if self.progress_callback:
-            await self.progress_callback("fetchingEvidence")
-        evid_words, evids = self.evid_fetcher(
-            [{'word': word, 'translated_word': translated_word}],
-            word_lang=self.lang,
-            only_intro=only_intro
-        )
-
-        if not evids or all(not sublist for sublist in evids):
-            if self.progress_callback:
-                await self.progress_callback("noEvidenceFound")
-            return {'word': word, 'claim': claim, 'predicted': '', 'in_wiki': 'No'}
-
-        if self.progress_callback:
-            await self.progress_callback("processingClaim")
-        processed_claim = await asyncio.to_thread(self.sent_connector, [
+    async def verify(self, word: str, claim: str, only_intro: bool = True,
+                     adaptive: bool = False, lang: str | None = None,
+                     progress_callback: Callable[[str], Awaitable[None]] | None = None,
+                     partial_callback: Callable[[str, dict], Awaitable[None]] | None = None):
+        """
+        Verify a definition of a word, reporting the stages and partial results while it is
+        verified.
+
+        :param word: The defined word.
+        :param claim: The definition.
+        :param only_intro: Flag to indicate if only the introductory section of documents should
+        be considered.
+        :param adaptive: Flag to fetch only the introductions and expand to the remaining
+        sections on demand. Overrides only_intro.
+        :param lang: Language of the word and the definition. Defaults to the language of the
+        pipeline.
+        :param progress_callback: Called with the name of each stage. Defaults to the callback
+        set with set_progress_callback.
+        :param partial_callback: Called with the kind and the data of each partial result:
+        'translation' (translated word and definition), 'splits' (atoms of the processed claim),
+        'evidence' (selected evidences) and 'atomVerdict' (prediction of an atom, identified by
+        its index in the splits).
+        :return: Verification result.
+        """
+        only_intro = only_intro or adaptive
+        lang = lang or self.lang
+        progress_callback = progress_callback or self.progress_callback
+        if progress_callback:
+            await progress_callback("startingVerification")
+
+        # Fetch what only needs the untranslated word and load the models while translating.
+        # The warm-up is not tied to the request: if the request ends early (no evidence, error),
+        # a model that is being loaded finishes loading and is unloaded once idle.
+        prefetch_token = child_token()
+        prefetch = asyncio.create_task(asyncio.to_thread(
+            propagate(self.evid_fetcher.prefetch, prefetch_token), word, lang))
+        warm_up = asyncio.create_task(asyncio.to_thread(self._warm_up))
+        unsettled = {prefetch, warm_up}  # tasks whose failure has not been handled
+        try:
+            translated = None
+            if self.translator and lang != 'en':
+                if progress_callback:
+                    await progress_callback("translating")
+                translated = await asyncio.to_thread(self._translate, lang,
+                                                     'translate_word_text_batch',
+                                                     [{'word': word, 'text': claim}],
+                                                     profile='word')
+            try:
+                prefetched = await prefetch
+            except RequestCancelled:
+                raise
+            except Exception as e:
+                # the prefetch is only an optimisation, the fetch does its work without it
+                logger.warning('Prefetch for %r failed, fetching without it: %r', word, e)
+                prefetched = None
+            unsettled.discard(prefetch)
+            if translated is not None:
+                translated = translated[0]
+                translated_word = translated.get('word', word)
+                translated_claim = translated.get('text', claim)
+            else:
+                translated_word = word
+                translated_claim = claim
+            if translated is not None and partial_callback:
+                await partial_callback('translation', {'word': translated_word,
+                                                       'claim': translated_claim})
+
+            if progress_callback:
+                await progress_callback("fetchingEvidence")
+            evid_words, evids = await asyncio.to_thread(
+                self.evid_fetcher,
+                [{'word': word, 'translated_word': translated_word, 'text': translated_claim,
+                  'prefetched': prefetched}],
+                word_lang=lang,
+                only_intro=only_intro
+            )
+
+            if not evids or all(not sublist for sublist in evids):
+                if progress_callback:
+                    await progress_callback("noEvidenceFound")
+                return {'word': word, 'claim': claim, 'predicted': '', 'in_wiki': 'No'}
+
+            await warm_up
+            unsettled.discard(warm_up)
+        finally:
+            if not prefetch.done():
+                prefetch_token.cancel()  # stops the thread of the prefetch at its next request
+                prefetch.cancel()
+            for task in unsettled:
+                task.add_done_callback(_log_failure)
+
+        if progress_callback:
+            await progress_callback("processingClaim")
+        processed_claim = await asyncio.to_thread(self._run, self.sent_connector,
+                                                  self.sent_connector, [
             {'word': evid_words[0], 'text': translated_claim}])
         processed_claim = processed_claim[0]
 
         if self.claim_splitter:
-            if self.progress_callback:
-                await self.progress_callback("splittingClaim")
+            if progress_callback:
+                await progress_callback("splittingClaim")
             processed_claim = await asyncio.to_thread(self.claim_splitter,
                                                       [processed_claim['text']])
             processed_claim = processed_claim[0]
+        if partial_callback:
+            await partial_callback('splits', {
+                'claim': processed_claim['text'],
+                'splits': processed_claim.get('splits', [processed_claim['text']])})
 
-        if self.progress_callback:
-            await self.progress_callback("selectingEvidence")
-        selected_evids = await asyncio.to_thread(self.evid_selector, [processed_claim], evids)
+        if progress_callback:
+            await progress_callback("selectingEvidence")
+        selected_evids = await asyncio.to_thread(self._select_evidences, [processed_claim], evids,
+                                                 adaptive)
         selected_evids = selected_evids[0]
+        if partial_callback:
+            await partial_callback('evidence', {'selected_evids': selected_evids})
 
-        if self.progress_callback:
-            await self.progress_callback("verifyingStatement")
-        factuality = await asyncio.to_thread(self.stm_verifier, [processed_claim], [selected_evids])
+        if progress_callback:
+            await progress_callback("verifyingStatement")
+        factuality = await asyncio.to_thread(self._run, self.stm_verifier, self.stm_verifier,
+                                             [processed_claim], [selected_evids])
         factuality = factuality[0]
+        if partial_callback:
+            for index, atom in enumerate(factuality.get('atoms', [])):
+                await partial_callback('atomVerdict', {'index': index, 'atom': atom['atom'],
+                                                       'predicted': atom['predicted']})
 
-        if self.progress_callback:
-            await self.progress_callback("verificationComplete")
+        if progress_callback:
+            await progress_callback("verificationComplete")
 
         return {
             'word': word,
@@ -170,3 +282,10 @@ class DefinitionProgressPipeline(Pipeline):
             'selected_evidences': selected_evids,
             'in_wiki': 'Yes'
         }
+
+    def _warm_up(self):
+        """Load the models of the components used after the evidence fetching."""
+        for component in (self.sent_connector, self.evid_selector, self.stm_verifier):
+            if hasattr(component, 'load_model') and not component.is_loaded:
+                with self._use(component):
+                    component.load_model()
@@ -1,45 +1,60 @@
 import asyncio
 from copy import deepcopy
+from typing import Awaitable, Callable
 
 from app.core.factVerification.general_utils.spacy_utils import get_main_entity
 from app.core.factVerification.pipeline_modules.claim_splitter import ClaimSplitter
 from app.core.factVerification.pipeline_modules.evidence_fetcher import EvidenceFetcher
 from app.core.factVerification.pipeline_modules.evidence_selector import EvidenceSelector
 from app.core.factVerification.pipeline_modules.statement_verifier import StatementVerifier
-from app.core.factVerification.pipeline_modules.translator import Translator
+from app.core.factVerification.pipeline_modules.translator import Translator, TranslatorPool
+from app.core.factVerification.pipelines.base_pipeline import ComponentsMixin
+from app.core.utils.cancellation import cancellation_scope, child_token
+from app.core.utils.memory_manager import MemoryManager
 
 
-class Pipeline:
+class Pipeline(ComponentsMixin):
     """General Pipeline for fetching evidence, selecting evidence, and verifying claims."""
 
     def __init__(self,
-                 translator: Translator | None,
+                 translator: Translator | TranslatorPool | None,
                  claim_splitter: ClaimSplitter | None,
                  evid_fetcher: EvidenceFetcher,
                  evid_selector: EvidenceSelector,
                  stm_verifier: StatementVerifier,
-                 lang: str):
+                 lang: str,
+                 memory_manager: MemoryManager | None = None):
         self.translator = translator
         self.claim_splitter = claim_splitter
         self.evid_fetcher = evid_fetcher
         self.evid_selector = evid_selector
         self.stm_verifier = stm_verifier
         self.lang = lang
+        self.memory_manager = memory_manager
 
-    def verify_batch(self, batch: list[dict], only_intro: bool = True) -> list[dict]:
+    def verify_batch(self, batch: list[dict], only_intro: bool = True,
+                     adaptive: bool = False, lang: str | None = None) -> list[dict]:
         """
         Verify a batch of claims by fetching, selecting, and verifying evidence.
 
         :param batch: list of dictionaries containing 'word' and 'text'.
         :param only_intro: Flag to indicate if only the introductory section of documents should
         be considered.
+        :param adaptive: Flag to fetch only the introductions and expand to the remaining
+        sections on demand, only if no sufficiently similar sentence is found. Overrides
+        only_intro.
+        :param lang: Language of the claims. Defaults to the language of the pipeline.
         :return: list of outputs with factuality and selected evidences.
         """
+        only_intro = only_intro or adaptive
+        lang = lang or self.lang
         processed_batch = deepcopy(batch)
 
-        if self.lang != 'en':
-            translation_batch = self.translator.translate_claim_batch(processed_batch)
-        else:
+        translation_batch = None
+        if lang != 'en':
+            translation_batch = self._translate(lang, 'translate_claim_batch', processed_batch,
+                                                profile='claim')
+        if translation_batch is None:
             translation_batch = processed_batch
 
         if self.claim_splitter:
@@ -57,25 +72,26 @@ class Pipeline:
         evids_words_batch, evids_batch = [], []
         for entry in entity_batch:
             if all(entry['words']):
-                evid_fetcher_input = [{'word': word, 'translated_word': word} for word in
-                                      entry['words']]
-                evid_words, evids = self.evid_fetcher(evid_fetcher_input, word_lang=self.lang,
+                evid_fetcher_input = [{'word': word, 'translated_word': word, 'text': split}
+                                      for word, split in zip(entry['words'], entry['splits'])]
+                evid_words, evids = self.evid_fetcher(evid_fetcher_input, word_lang=lang,
                                                       only_intro=only_intro)
             else:
                 evid_words, evids = [], []
             evids_words_batch.append(evid_words)
             evids_batch.append(evids)
 
-        outputs = []
+        outputs = [None] * len(processed_batch)  # in the order of the batch
+        filtered_indices = []
         filtered_batch = []
         filtered_evids = []
-        for entry, evids, words in zip(processed_batch, evids_batch, evids_words_batch):
+        for i, (entry, evids) in enumerate(zip(processed_batch, evids_batch)):
             if not all(evids) or not evids:
-                outputs.append(
-                    {'claim': entry.get('text'),
-                     'predicted': -1,
-                     'in_wiki': 'No'})
+                outputs[i] = {'claim': entry.get('text'),
+                              'predicted': -1,
+                              'in_wiki': 'No'}
             else:
+                filtered_indices.append(i)
                 filtered_batch.append(entry)
                 filtered_evids.append(evids)
 
@@ -84,28 +100,35 @@ class Pipeline:
 
         factualities = []
         for entry, evid in zip(filtered_batch, filtered_evids):
-            selected_evids = self.evid_selector([{'text': split} for split in entry['splits']],
-                                                evid)
-            factuality = self.stm_verifier.verify_splitted_claim(entry, selected_evids)
+            selected_evids = self._select_evidences([{'text': split} for split in entry['splits']],
+                                                    evid, adaptive)
+            factuality = self._run(self.stm_verifier, self.stm_verifier.verify_splitted_claim,
+                                   entry, selected_evids)
             factualities.append(factuality)
 
-        for factuality, entry in zip(factualities, filtered_batch):
-            outputs.append({'claim': entry.get('text'),
-                            **factuality,
-                            'in_wiki': 'Yes'})
+        for i, factuality, entry in zip(filtered_indices, factualities, filtered_batch):
+            outputs[i] = {'claim': entry.get('text'),
+                          **factuality,
+                          'in_wiki': 'Yes'}
         return outputs
 
-    def verify(self, claim: str, only_intro: bool = True) -> dict:
+    def verify(self, claim: str, only_intro: bool = True, adaptive: bool = False,
+               lang: str | None = None) -> dict:
         """
         Verify a single claim.
 
         :param claim: The claim to verify.
         :param only_intro: Flag to indicate if only the introductory section of documents should
         be considered.
+        :param adaptive: Flag to fetch only the introductions and expand to the remaining
+        sections on demand, only if no sufficiently similar sentence is found. Overrides
+        only_intro.
+        :param lang: Language of the claim. Defaults to the language of the pipeline.
         :return: Verification result.
         """
         entry = {'text': claim}
-        return self.verify_batch([entry], only_intro=only_intro)[0]
+        return self.verify_batch([entry], only_intro=only_intro, adaptive=adaptive,
+                                 lang=lang)[0]
 
 
 class ProgressPipeline(Pipeline):
@@ -116,63 +139,159 @@ class ProgressPipeline(Pipeline):
     def set_progress_callback(self, callback):
         self.progress_callback = callback
 
-    async def verify(self, claim: str, only_intro: bool = True):
-        if self.progress_callback:
-            await self.progress_callback("startingVerification")
+    async def verify(self, claim: str, only_intro: bool = True, adaptive: bool = False,
+                     lang: str | None = None,
+                     progress_callback: Callable[[str], Awaitable[None]] | None = None,
+                     partial_callback: Callable[[str, dict], Awaitable[None]] | None = None):
+        """
+        Verify a claim, reporting the stages and partial results while it is verified.
 
-        if self.translator and self.lang != 'en':
-            if self.progress_callback:
-                await self.progress_callback("translating")
-            translated_claim = await asyncio.to_thread(self.translator.translate_text, claim)
-        else:
+        :param claim: The claim to verify.
+        :param only_intro: Flag to indicate if only the introductory section of documents should
+        be considered.
+        :param adaptive: Flag to fetch only the introductions and expand to the remaining
+        sections on demand. Overrides only_intro.
+        :param lang: Language of the claim. Defaults to the language of the pipeline.
+        :param progress_callback: Called with the name of each stage. Defaults to the callback
+        set with set_progress_callback.
+        :param partial_callback: Called with the kind and the data of each partial result:
+        'translation' (translated claim), 'splits' (atoms and their entities), 'atomEvidence'
+        (selected evidences of an atom) and 'atomVerdict' (prediction of an atom). Atoms are
+        identified by their index in the splits.
+        :return: Verification result.
+        """
+        only_intro = only_intro or adaptive
+        lang = lang or self.lang
+        progress_callback = progress_callback or self.progress_callback
+        if progress_callback:
+            await progress_callback("startingVerification")
+
+        translated_claim = None
+        if self.translator and lang != 'en':
+            if progress_callback:
+                await progress_callback("translating")
+            translated_claim = await asyncio.to_thread(self._translate, lang, 'translate_text',
+                                                       claim, profile='claim')
+        if translated_claim is None:
             translated_claim = claim
+        elif partial_callback:
+            await partial_callback('translation', {'claim': translated_claim})
 
         if self.claim_splitter:
-            if self.progress_callback:
-                await self.progress_callback("splittingClaim")
+            if progress_callback:
+                await progress_callback("splittingClaim")
             splitted_entry = await asyncio.to_thread(self.claim_splitter.get_atomic_claims,
                                                      translated_claim)
         else:
             splitted_entry = {'text': translated_claim, 'splits': [translated_claim]}
 
-        if self.progress_callback:
-            await self.progress_callback("extractingEntities")
-        splitted_entry['words'] = []
-        for split in splitted_entry['splits']:
-            splitted_entry['words'].append(get_main_entity(split))
-
-        if self.progress_callback:
-            await self.progress_callback("fetchingEvidence")
+        if progress_callback:
+            await progress_callback("extractingEntities")
+        splitted_entry['words'] = await asyncio.to_thread(
+            lambda: [get_main_entity(split) for split in splitted_entry['splits']])
+        if partial_callback:
+            await partial_callback('splits', {'splits': splitted_entry['splits'],
+                                              'entities': splitted_entry['words']})
 
-        if all(splitted_entry['words']):
-            evid_fetcher_input = [{'word': word, 'translated_word': word} for word in
-                                  splitted_entry['words']]
-            evid_words, evids = self.evid_fetcher(evid_fetcher_input, word_lang=self.lang,
-                                                  only_intro=only_intro)
-        else:
-            evid_words, evids = [], []
-
-        if not evids or not all(evids):
-            if self.progress_callback:
-                await self.progress_callback("noEvidenceFound")
+        if progress_callback:
+            await progress_callback("fetchingEvidence")
+        atoms = await self._verify_atoms(splitted_entry['splits'], splitted_entry['words'], lang,
+                                         only_intro, adaptive, progress_callback,
+                                         partial_callback)
+        if not atoms:
+            if progress_callback:
+                await progress_callback("noEvidenceFound")
             return {'claim': claim, 'predicted': '', 'in_wiki': 'No'}
+        factuality = self.stm_verifier.combine_atom_results(atoms)
 
-        if self.progress_callback:
-            await self.progress_callback("selectingEvidence")
-
-        selected_evids = await asyncio.to_thread(self.evid_selector, [{'text': split} for split in
-                                                                      splitted_entry['splits']],
-                                                 evids)
-
-        if self.progress_callback:
-            await self.progress_callback("verifyingStatement")
-        factuality = await asyncio.to_thread(self.stm_verifier.verify_splitted_claim, splitted_entry, selected_evids)
-
-        if self.progress_callback:
-            await self.progress_callback("verificationComplete")
+        if progress_callback:
+            await progress_callback("verificationComplete")
 
         return {
             'claim': claim,
             **factuality,
             'in_wiki': 'Yes'
         }
+
+    async def _verify_atoms(self, splits: list[str], words: list[str], lang: str,
+                            only_intro: bool, adaptive: bool,
+                            progress_callback: Callable[[str], Awaitable[None]] | None = None,
+                            partial_callback: Callable[[str, dict], Awaitable[None]] | None = None
+                            ) -> list[dict] | None:
+        """
+        Fetch, select and verify the atoms of a claim concurrently. Each atom is selected for and
+        verified as soon as the evidences of its entity arrive, while the other fetches are still
+        in flight. Atoms sharing an entity share one fetch, as in a batched fetch.
+
+        :param splits: The atomic claims.
+        :param words: The main entity of each atom.
+        :param lang: Language of the words.
+        :param only_intro: Flag to fetch only the introductions.
+        :param adaptive: Flag to expand to the remaining sections on demand.
+        :param progress_callback: Called with the name of each stage the first time an atom
+        reaches it.
+        :param partial_callback: Called with the selected evidences and the verdict of each atom.
+        :return: Result per atom, in the order of the splits. None if an atom has no entity or no
+        evidences, in which case the pending fetches are cancelled. The atoms run under a child
+        cancellation token, so the threads of the cancelled fetches stop as well.
+        """
+        if not all(words):
+            return None
+
+        entities: dict[str, list[int]] = {}
+        for i, word in enumerate(words):
+            entities.setdefault(word, []).append(i)
+
+        reported = set()
+
+        async def report(stage: str):
+            if progress_callback and stage not in reported:
+                reported.add(stage)
+                await progress_callback(stage)
+
+        async def verify_atom(index: int, evids: list[dict]) -> dict:
+            await report("selectingEvidence")
+            selected_evids = await asyncio.to_thread(self._select_evidences,
+                                                     [{'text': splits[index]}], [evids], adaptive)
+            if partial_callback:
+                await partial_callback('atomEvidence', {'index': index, 'atom': splits[index],
+                                                        'selected_evids': selected_evids[0]})
+            await report("verifyingStatement")
+            atom = await asyncio.to_thread(self._run, self.stm_verifier,
+                                           self.stm_verifier.verify_atom, splits[index],
+                                           selected_evids[0])
+            if partial_callback:
+                await partial_callback('atomVerdict', {'index': index, 'atom': splits[index],
+                                                       'predicted': atom['predicted']})
+            return atom
+
+        async def verify_entity(word: str, indices: list[int]) -> list[dict] | None:
+            evid_fetcher_input = [{'word': word, 'translated_word': word, 'text': splits[i]}
+                                  for i in indices]
+            _, evids = await asyncio.to_thread(self.evid_fetcher, evid_fetcher_input,
+                                               only_intro=only_intro, word_lang=lang)
+            if not all(evids):
+                return None
+            return await asyncio.gather(*(verify_atom(i, evid) for i, evid in zip(indices, evids)))
+
+        token = child_token()
+        with cancellation_scope(token):  # the tasks and their threads copy the scope
+            tasks = {asyncio.create_task(verify_entity(word, indices)): indices
+                     for word, indices in entities.items()}
+        atoms = [None] * len(splits)
+        pending = set(tasks)
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    results = task.result()
+                    if results is None:
+                        return None
+                    for i, atom in zip(tasks[task], results):
+                        atoms[i] = atom
+        finally:
+            if pending:
+                token.cancel()
+            for task in pending:
+                task.cancel()
+        return atoms
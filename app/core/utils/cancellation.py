@@ -0,0 +1,120 @@
+"""Module for cancelling the work of a request across threads."""
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable
+
+
+class RequestCancelled(Exception):
+    """Raised in the work of a request that has been cancelled."""
+
+
+class CancellationToken:
+    """
+    Signals the cancellation of a request to all of its stages, whichever thread they run in.
+    The token of the current request is held in a context variable, which asyncio.to_thread
+    copies into its thread. Executor threads need to be bound with propagate(). Parts of a
+    request that can be abandoned on their own run under a child token, which is cancelled with
+    its parent.
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._children: list[CancellationToken] = []
+
+    def cancel(self):
+        """Cancel the request and the work of its child tokens."""
+        with self._lock:
+            self._event.set()
+            children, self._children = self._children, []
+        for child in children:
+            child.cancel()
+
+    def child(self) -> 'CancellationToken':
+        """Create a token that can be cancelled on its own and is cancelled with this one."""
+        child = CancellationToken()
+        with self._lock:
+            if not self._event.is_set():
+                self._children.append(child)
+                return child
+        child.cancel()
+        return child
+
+    @property
+    def cancelled(self) -> bool:
+        """Whether the request has been cancelled."""
+        return self._event.is_set()
+
+    def raise_if_cancelled(self):
+        """Raise RequestCancelled if the request has been cancelled."""
+        if self.cancelled:
+            raise RequestCancelled()
+
+    def sleep(self, seconds: float):
+        """Sleep, but raise RequestCancelled as soon as the request is cancelled."""
+        if self._event.wait(seconds):
+            raise RequestCancelled()
+
+
+_current_token: ContextVar[CancellationToken | None] = ContextVar('cancellation_token',
+                                                                  default=None)
+
+
+def current_token() -> CancellationToken | None:
+    """Return the token of the current request, None outside of cancellable requests."""
+    return _current_token.get()
+
+
+@contextmanager
+def cancellation_scope(token: CancellationToken | None):
+    """
+    Context in which the work belongs to the request of the token.
+
+    :param token: The token. None makes the work not cancellable.
+    """
+    reset = _current_token.set(token)
+    try:
+        yield token
+    finally:
+        _current_token.reset(reset)
+
+
+def check_cancelled():
+    """Raise RequestCancelled if the current request has been cancelled."""
+    token = _current_token.get()
+    if token is not None:
+        token.raise_if_cancelled()
+
+
+def sleep(seconds: float):
+    """Sleep, but raise RequestCancelled as soon as the current request is cancelled."""
+    token = _current_token.get()
+    if token is None:
+        time.sleep(seconds)
+    else:
+        token.sleep(seconds)
+
+
+def child_token() -> CancellationToken:
+    """Create a child of the token of the current request, a new token outside of requests."""
+    token = _current_token.get()
+    return token.child() if token is not None else CancellationToken()
+
+
+def propagate(fn: Callable, token: CancellationToken | None = None) -> Callable:
+    """
+    Bind fn to the token of the current request, so the work it does in executor threads is
+    cancelled with the request.
+
+    :param fn: The function to run in another thread.
+    :param token: Token to bind fn to instead, e.g. a child token.
+    :return: Function running fn within the cancellation scope of the caller.
+    """
+    token = token or _current_token.get()
+
+    def run(*args, **kwargs):
+        with cancellation_scope(token):
+            return fn(*args, **kwargs)
+    return run
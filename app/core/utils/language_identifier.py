@@ -0,0 +1,98 @@
+"""Module for identifying the language of texts."""
+from functools import lru_cache
+
+from langdetect.detector_factory import PROFILES_DIRECTORY, DetectorFactory
+from langdetect.lang_detect_exception import LangDetectException
+
+
+class LanguageIdentifier:
+    """
+    Deterministic language identification with langdetect. The language profiles are loaded
+    once, detection uses a fixed seed, so the same text always gets the same language, and
+    results are cached per text. Texts whose language cannot be identified confidently are
+    assigned the default language.
+
+    langdetect estimates the probabilities from a few random trials, so a short text that is
+    clearly in one language often gets only 4/7 or 5/7 of the votes (e.g. 0.71 for "Angela Merkel
+    war Kanzlerin"). Short texts therefore only need short_min_confidence, which accepts the
+    language of the majority of the trials.
+    """
+
+    def __init__(self, default_lang: str = 'en', min_confidence: float = 0.7,
+                 min_length: int = 3, short_length: int = 40, short_min_confidence: float = 0.5,
+                 languages: set[str] | None = None, seed: int = 0, cache_size: int = 10000):
+        """
+        Initialize the LanguageIdentifier.
+
+        :param default_lang: Language assigned to texts that cannot be identified confidently.
+        :param min_confidence: Probability from which the detected language is used.
+        :param min_length: Minimum number of letters needed to run the detection.
+        :param short_length: Texts with fewer letters count as short.
+        :param short_min_confidence: Probability from which the detected language of a short text
+        is used.
+        :param languages: Languages that can be reported. Other detected languages are treated
+        as unidentified. None allows every language langdetect knows.
+        :param seed: Seed of the detection.
+        :param cache_size: Number of texts whose result is cached.
+        """
+        self.default_lang = default_lang
+        self.min_confidence = min_confidence
+        self.min_length = min_length
+        self.short_length = short_length
+        self.short_min_confidence = short_min_confidence
+        self.languages = languages
+        self._factory = DetectorFactory()
+        self._factory.load_profile(PROFILES_DIRECTORY)
+        self._factory.set_seed(seed)
+        self._detect = lru_cache(maxsize=cache_size)(self._detect_uncached)
+
+    def detect(self, text: str) -> tuple[str, float]:
+        """
+        Identify the language of a text.
+
+        :param text: The text.
+        :return: The language as ISO 639-1 code (langdetect's e.g. zh-cn is reported as zh) and
+        the confidence. The default language if the confidence is below min_confidence.
+        """
+        return self._detect(text)
+
+    def detect_batch(self, texts: list[str]) -> list[tuple[str, float]]:
+        """
+        Identify the languages of several texts. Repeated texts are only detected once.
+
+        :param texts: The texts.
+        :return: Language and confidence per text.
+        """
+        detected = {text: self._detect(text) for text in dict.fromkeys(texts)}
+        return [detected[text] for text in texts]
+
+    def _detect_uncached(self, text: str) -> tuple[str, float]:
+        num_letters = sum(char.isalpha() for char in text)
+        if num_letters < self.min_length:
+            return self.default_lang, 0.0
+        min_confidence = self.short_min_confidence if num_letters < self.short_length \
+            else self.min_confidence
+
+        detector = self._factory.create()
+        detector.append(text)
+        try:
+            probabilities = detector.get_probabilities()
+        except LangDetectException:
+            return self.default_lang, 0.0
+
+        for candidate in probabilities:
+            lang = candidate.lang.split('-')[0]
+            if self.languages is None or lang in self.languages:
+                if candidate.prob < min_confidence:
+                    return self.default_lang, candidate.prob
+                return lang, candidate.prob
+        return self.default_lang, 0.0
+
+    def stats(self) -> dict:
+        """
+        Return the cache statistics.
+
+        :return: Dictionary with the cache hits, misses and size.
+        """
+        info = self._detect.cache_info()
+        return {'hits': info.hits, 'misses': info.misses, 'cached': info.currsize}
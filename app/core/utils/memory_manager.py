@@ -0,0 +1,168 @@
+"""Module for unloading idle models."""
+import ctypes
+import gc
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from app.core.utils.model_registry import rss_bytes
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryManager:
+    """
+    Unloads the models of components (anything with load_model, unload_model and is_loaded) that
+    have not been used for idle_timeout seconds, and the least recently used ones while the
+    resident memory of the process exceeds the budget. Components are used within use(), which
+    keeps their model loaded until the block is left. Unloaded models are reloaded by the
+    components themselves on their next use, so calls that do not need the model (e.g. cache
+    hits) do not load it.
+    """
+
+    def __init__(self, rss_budget_bytes: int | None = None,
+                 idle_timeout: float | None = 900.0,
+                 check_interval: float = 30.0):
+        """
+        Initialize the MemoryManager.
+
+        :param rss_budget_bytes: Resident memory of the process above which idle models are
+        unloaded, least recently used first. None disables the budget.
+        :param idle_timeout: Seconds after their last use after which models are unloaded. None
+        disables unloading of idle models.
+        :param check_interval: Seconds between two checks of the background thread.
+        """
+        self.rss_budget_bytes = rss_budget_bytes
+        self.idle_timeout = idle_timeout
+        self.check_interval = check_interval
+
+        self._lock = threading.Lock()
+        self._entries: dict[int, dict] = {}
+        self.unloads = 0
+        self._thread = None
+
+    def register(self, component, name: str | None = None):
+        """
+        Track the model of a component. Components used within use() are registered
+        automatically.
+
+        :param component: The component.
+        :param name: Name reported in the stats. Defaults to the model name of the component or
+        its class name.
+        :return: The component.
+        """
+        with self._lock:
+            self._register(component, name)
+        return component
+
+    def _register(self, component, name: str | None = None) -> dict:
+        entry = self._entries.get(id(component))
+        if entry is None:
+            entry = self._entries[id(component)] = {
+                'component': component,
+                'name': name or getattr(component, 'model_name', type(component).__name__),
+                'busy': 0,
+                'last_used': time.monotonic()
+            }
+        return entry
+
+    @contextmanager
+    def use(self, component):
+        """
+        Context in which the model of the component will not be unloaded.
+
+        :param component: The component. Components without a model are passed through.
+        """
+        if not hasattr(component, 'load_model'):
+            yield component
+            return
+
+        with self._lock:
+            entry = self._register(component)
+            entry['busy'] += 1
+            entry['last_used'] = time.monotonic()
+        try:
+            yield component
+        finally:
+            with self._lock:
+                entry['busy'] -= 1
+                entry['last_used'] = time.monotonic()
+
+    def start(self):
+        """Start the background thread unloading idle models."""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='memory-manager',
+                                                daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.check_interval)
+            try:
+                self.collect()
+            except Exception:
+                logger.exception("Error while unloading models")
+
+    def collect(self) -> list[str]:
+        """
+        Unload idle models and, while over the memory budget, the least recently used ones.
+
+        :return: Names of the unloaded components.
+        """
+        with self._lock:
+            candidates = sorted((entry for entry in self._entries.values()
+                                 if entry['component'].is_loaded and not entry['busy']),
+                                key=lambda entry: entry['last_used'])
+
+        unloaded = []
+        now = time.monotonic()
+        for entry in candidates:
+            idle = self.idle_timeout is not None and \
+                now - entry['last_used'] > self.idle_timeout
+            over_budget = self.rss_budget_bytes is not None and \
+                rss_bytes() > self.rss_budget_bytes
+            if not (idle or over_budget):
+                continue
+            if self._unload(entry):
+                unloaded.append(entry['name'])
+                logger.info('Unloaded %s (%s)', entry['name'],
+                            'idle' if idle else 'memory pressure')
+        return unloaded
+
+    def _unload(self, entry: dict) -> bool:
+        with self._lock:
+            if entry['busy'] or not entry['component'].is_loaded:
+                return False  # used again in the meantime
+            entry['component'].unload_model()
+            self.unloads += 1
+        gc.collect()
+        self._trim()
+        return True
+
+    @staticmethod
+    def _trim():
+        """Return freed memory to the os, otherwise the resident memory does not shrink."""
+        try:
+            ctypes.CDLL('libc.so.6').malloc_trim(0)
+        except (OSError, AttributeError):
+            pass
+
+    def stats(self) -> dict:
+        """
+        Return the memory of the process and the state of the tracked models.
+
+        :return: Dictionary with the resident memory, the budget, the unload count and per
+        component whether its model is loaded, in use and for how long it has been idle.
+        """
+        now = time.monotonic()
+        with self._lock:
+            components = [{'name': entry['name'],
+                           'loaded': entry['component'].is_loaded,
+                           'busy': entry['busy'],
+                           'idle_seconds': now - entry['last_used']}
+                          for entry in self._entries.values()]
+            unloads = self.unloads
+        return {'rss_bytes': rss_bytes(), 'rss_budget_bytes': self.rss_budget_bytes,
+                'unloads': unloads, 'components': components}
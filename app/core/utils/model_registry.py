@@ -0,0 +1,84 @@
+"""Module for sharing models between components."""
+import os
+import threading
+from typing import Any, Callable
+
+
+def rss_bytes() -> int:
+    """Return the resident memory of the current process in bytes."""
+    with open('/proc/self/statm', 'r', encoding='utf-8') as statm:
+        return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+class ModelRegistry:
+    """
+    Process-wide registry of models, tokenizers and onnx sessions. Components acquire instances
+    by name, so an instance is only loaded once per process however many components use it, and
+    release them when they do not need them anymore. An instance is dropped once its last
+    reference is released.
+
+    The memory of an entry is measured as the growth of the resident memory while loading it.
+    Loads are serialized, so the measurement is not distorted by other loads.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._entries: dict[str, dict] = {}
+
+    def acquire(self, name: str, loader: Callable[[], Any]) -> Any:
+        """
+        Return the instance registered under the name, loading it if needed.
+
+        :param name: Name of the instance, e.g. 'tokenizer:roberta-large'.
+        :param loader: Function loading the instance if it is not registered.
+        :return: The shared instance. Every call needs a matching release.
+        """
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is not None:
+                entry['refs'] += 1
+                return entry['instance']
+
+        with self._load_lock:
+            with self._lock:  # might have been loaded while waiting
+                entry = self._entries.get(name)
+                if entry is not None:
+                    entry['refs'] += 1
+                    return entry['instance']
+
+            rss_before = rss_bytes()
+            instance = loader()
+            memory = max(0, rss_bytes() - rss_before)
+            with self._lock:
+                self._entries[name] = {'instance': instance, 'refs': 1, 'memory_bytes': memory}
+            return instance
+
+    def release(self, name: str):
+        """
+        Release a reference to an instance. The instance is dropped with its last reference.
+
+        :param name: Name of the instance.
+        """
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is None:
+                return
+            entry['refs'] -= 1
+            if entry['refs'] <= 0:
+                del self._entries[name]
+
+    def stats(self) -> dict:
+        """
+        Return the registered instances and the memory of the process.
+
+        :return: Dictionary with the resident memory of the process and the references and
+        memory per entry.
+        """
+        with self._lock:
+            entries = {name: {'refs': entry['refs'], 'memory_bytes': entry['memory_bytes']}
+                       for name, entry in self._entries.items()}
+        return {'rss_bytes': rss_bytes(), 'entries': entries}
+
+
+model_registry = ModelRegistry()
@@ -0,0 +1,68 @@
+"""Module for deduplicating concurrent calls."""
+import threading
+from concurrent.futures import Future
+from typing import Callable, Hashable
+
+from app.core.utils.cancellation import RequestCancelled, check_cancelled
+
+
+class SingleFlight:
+    """
+    Deduplicates concurrent calls with the same key: while a call is in flight, identical calls
+    wait for it and share its result (or exception) instead of executing again. Shared results
+    are the same objects for all callers and must not be modified.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: dict[Hashable, Future] = {}
+        self.executed = 0
+        self.shared = 0
+
+    def do(self, key: Hashable, fn: Callable, *args, **kwargs):
+        """
+        Execute fn(*args, **kwargs) unless a call with the same key is in flight, in which case
+        its result is awaited and returned.
+
+        :param key: Key identifying identical calls.
+        :param fn: The function to call.
+        :return: The result of the call.
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+                self.executed += 1
+            else:
+                self.shared += 1
+
+        if not leader:
+            try:
+                return future.result()
+            except RequestCancelled:
+                # the request of the leader was cancelled, not necessarily this one
+                check_cancelled()
+                return self.do(key, fn, *args, **kwargs)
+
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    def stats(self) -> dict:
+        """
+        Return how many calls were executed and how many shared the result of another call.
+
+        :return: Dictionary with the number of executed, shared and in-flight calls.
+        """
+        with self._lock:
+            return {'executed': self.executed, 'shared': self.shared,
+                    'in_flight': len(self._calls)}
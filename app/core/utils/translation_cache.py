@@ -0,0 +1,105 @@
+"""Module for caching translations."""
+import json
+import sqlite3
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+
+class TranslationCache:
+    """
+    Two-tier cache of translations keyed by (model, source text, profile): an in-process LRU and
+    an optional sqlite database on disk, so translations survive restarts and can be shared by
+    the workers of a node.
+    """
+
+    def __init__(self, max_entries: int = 10000, path: str | Path | None = None):
+        """
+        Initialize the TranslationCache.
+
+        :param max_entries: Maximum number of translations kept in memory.
+        :param path: File of the on-disk tier. Only the in-memory tier is used if not given.
+        """
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, list[str]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if path is not None:
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('CREATE TABLE IF NOT EXISTS translations '
+                             '(key TEXT PRIMARY KEY, translations TEXT NOT NULL)')
+            self._db.commit()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(model: str, text: str, profile: str) -> str:
+        """Create the key of a translation."""
+        return json.dumps([model, text, profile], ensure_ascii=False)
+
+    def get(self, model: str, text: str, profile: str) -> list[str] | None:
+        """
+        Retrieve the translations of a text.
+
+        :param model: Name of the translation model.
+        :param text: The source text.
+        :param profile: Profile (or generation settings) the text was translated with.
+        :return: The translations or None if not cached.
+        """
+        key = self.make_key(model, text, profile)
+        with self._lock:
+            translations = self._entries.get(key)
+            if translations is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return translations
+
+            if self._db is not None:
+                row = self._db.execute('SELECT translations FROM translations WHERE key = ?',
+                                       (key,)).fetchone()
+                if row is not None:
+                    translations = json.loads(row[0])
+                    self._remember(key, translations)
+                    self.disk_hits += 1
+                    return translations
+            self.misses += 1
+            return None
+
+    def put(self, model: str, text: str, profile: str, translations: list[str]):
+        """
+        Store the translations of a text.
+
+        :param model: Name of the translation model.
+        :param text: The source text.
+        :param profile: Profile (or generation settings) the text was translated with.
+        :param translations: The translations.
+        """
+        key = self.make_key(model, text, profile)
+        with self._lock:
+            self._remember(key, translations)
+            if self._db is not None:
+                self._db.execute('INSERT OR REPLACE INTO translations VALUES (?, ?)',
+                                 (key, json.dumps(translations, ensure_ascii=False)))
+                self._db.commit()
+
+    def _remember(self, key: str, translations: list[str]):
+        self._entries[key] = translations
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        """
+        Return the hits and misses of the cache.
+
+        :return: Dictionary with the number of entries in memory, memory hits, disk hits, misses
+        and the hit rate.
+        """
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {'entries': len(self._entries), 'hits': self.hits,
+                    'disk_hits': self.disk_hits, 'misses': self.misses,
+                    'hit_rate': (self.hits + self.disk_hits) / lookups if lookups else None}
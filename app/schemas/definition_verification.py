@@ -1,14 +1,28 @@
 from pydantic import BaseModel
 
 
-class VerificationRequest(BaseModel):
+class VerificationEntry(BaseModel):
     word: str
     claim: str
 
 
+class VerificationRequest(VerificationEntry):
+    # verify against the introductions first and fetch the remaining sections only if needed
+    adaptive: bool = False
+
+
+class BatchVerificationRequest(BaseModel):
+    entries: list[VerificationEntry]
+    adaptive: bool = False
+
+
 class VerificationResponse(BaseModel):
     word: str
     claim: str
     predicted: str
     in_wiki: str
     selected_evidences: list[dict] | None = None
+
+
+class BatchVerificationResponse(BaseModel):
+    results: list[dict]
@@ -1,10 +1,15 @@
 from pydantic import BaseModel
 
 
-class VerificationRequest(BaseModel):
+class VerificationEntry(BaseModel):
     claim: str
 
 
+class VerificationRequest(VerificationEntry):
+    # verify against the introductions first and fetch the remaining sections only if needed
+    adaptive: bool = False
+
+
 class EvidResponse(BaseModel):
     title: str
     line_idx: int
@@ -18,9 +23,18 @@ class AtomResponse(BaseModel):
     selected_evids: list[EvidResponse]
 
 
+class BatchVerificationRequest(BaseModel):
+    entries: list[VerificationEntry]
+    adaptive: bool = False
+
+
 class VerificationResponse(BaseModel):
     claim: str
     predicted: str
     factuality: float
     in_wiki: str
     atoms: list[AtomResponse] | None = None
+
+
+class BatchVerificationResponse(BaseModel):
+    results: list[dict]
@@ -0,0 +1,83 @@
+"""Benchmarks split_into_passages against the previous per-sentence implementation on long
+Wikipedia articles.
+
+The previous implementation tokenized and decoded each sentence and passage separately and
+shrank max_length with every sentence, so its boundaries drifted within an article. Both
+implementations are timed with the slow and the fast tokenizer; the new boundaries are checked
+to be exactly every max_length tokens of the concatenated sentence tokens.
+
+Run from the project root:
+python -m scripts.benchmark_passages "Germany" "World War II" "Albert Einstein" --repeat 3
+"""
+import argparse
+import time
+
+import numpy as np
+from transformers import AutoTokenizer, RobertaTokenizer
+
+from app.core.factVerification.fetchers.wikipedia import Wikipedia
+from app.core.factVerification.general_utils.spacy_utils import split_into_sentences
+from app.core.factVerification.general_utils.utils import split_into_passages
+
+
+def legacy_split_into_passages(text: list[str], tokenizer, max_length=256) -> list[str]:
+    passages = [[]]
+    for sent in text:
+        assert len(sent.strip()) > 0
+        tokens = tokenizer(sent)["input_ids"]
+        max_length = max_length - len(passages[-1])
+        if len(tokens) <= max_length:
+            passages[-1].extend(tokens)
+        else:
+            passages[-1].extend(tokens[:max_length])
+            offset = max_length
+            while offset < len(tokens):
+                passages.append(tokens[offset:offset + max_length])
+                offset += max_length
+
+    return [tokenizer.decode(tokens) for tokens in passages if
+            np.sum([t not in [0, 2] for t in tokens]) > 0]
+
+
+def timed(fn, *args, repeat: int = 1) -> tuple[float, list[str]]:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(*args)
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('titles', nargs='+')
+    parser.add_argument('--max-length', type=int, default=256)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    tokenizers = {'slow': RobertaTokenizer.from_pretrained('roberta-large'),
+                  'fast': AutoTokenizer.from_pretrained('roberta-large')}
+    raw_pages = Wikipedia().get_text_from_title(args.titles, only_intro=False, return_raw=True)
+
+    for title, text in raw_pages.items():
+        sentences = split_into_sentences(text)
+        print(f'{title}: {len(sentences)} sentences')
+        for name, tokenizer in tokenizers.items():
+            legacy_time, legacy = timed(legacy_split_into_passages, sentences, tokenizer,
+                                        args.max_length, repeat=args.repeat)
+            new_time, passages = timed(split_into_passages, sentences, tokenizer,
+                                       args.max_length, repeat=args.repeat)
+            print(f'  {name} tokenizer: legacy {legacy_time * 1000:.1f} ms '
+                  f'({len(legacy)} passages), batched {new_time * 1000:.1f} ms '
+                  f'({len(passages)} passages), speedup {legacy_time / new_time:.1f}x')
+
+        tokenizer = tokenizers['fast']
+        tokens = [t for sentence in sentences for t in tokenizer(sentence)['input_ids']]
+        chunks = [tokens[i:i + args.max_length] for i in range(0, len(tokens), args.max_length)]
+        expected = [tokenizer.decode(chunk) for chunk in chunks
+                    if set(chunk) - set(tokenizer.all_special_ids)]
+        assert passages == expected, f'passage boundaries of {title} differ'
+
+
+if __name__ == "__main__":
+    main()
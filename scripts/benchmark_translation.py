@@ -0,0 +1,129 @@
+"""Benchmarks the translation latency per claim of OpusMTTranslator with the torch and the onnx
+backend.
+
+Each claim is translated with translate_text (as in ProgressPipeline.verify) and with
+translate_word_text (as in DefinitionProgressPipeline.verify). The claims are read from a file
+with one claim per line, formatted as 'word: definition' for the word translations.
+
+With --profiles, every translation profile is additionally compared to the 20 beam search that
+was used for all call sites before: latency per claim, the share of identical translations and
+the chrF of the translations. The chrF is computed against reference translations if given
+(--references, one per claim line), otherwise against the 20 beam search. The comparison is
+printed as a markdown table, to be recorded before the default profile of a call site changes.
+
+Run from the project root:
+python -m scripts.benchmark_translation claims.txt --backends torch onnx --profiles
+--references references.txt
+"""
+import argparse
+import time
+from collections import Counter
+
+import numpy as np
+
+from app.core.factVerification.pipeline_modules.translator import OpusMTTranslator
+from app.core.utils.reader import LineReader
+
+
+def benchmark(fn, inputs: list) -> tuple[list[float], list]:
+    latencies, outputs = [], []
+    for entry in inputs:
+        start = time.perf_counter()
+        outputs.append(fn(*entry))
+        latencies.append(time.perf_counter() - start)
+    return latencies, outputs
+
+
+def report(name: str, latencies: list[float]):
+    latencies = np.array(latencies) * 1000
+    print(f'  {name}: mean {latencies.mean():.1f} ms, p50 {np.quantile(latencies, 0.5):.1f} ms, '
+          f'p95 {np.quantile(latencies, 0.95):.1f} ms')
+
+
+def chrf(hypotheses: list[str], references: list[str], max_order: int = 6,
+         beta: float = 2.0) -> float:
+    """Corpus-level chrF (character n-gram F-score, whitespace removed) in percent, as
+    sacrebleu's CHRF with its default settings."""
+    matches, hyp_counts, ref_counts = np.zeros(max_order), np.zeros(max_order), \
+        np.zeros(max_order)
+    for hypothesis, reference in zip(hypotheses, references):
+        hypothesis, reference = ''.join(hypothesis.split()), ''.join(reference.split())
+        for n in range(1, max_order + 1):
+            hyp_ngrams = Counter(hypothesis[i:i + n] for i in range(len(hypothesis) - n + 1))
+            ref_ngrams = Counter(reference[i:i + n] for i in range(len(reference) - n + 1))
+            matches[n - 1] += sum((hyp_ngrams & ref_ngrams).values())
+            if ref_ngrams:  # as sacrebleu, not counted if the reference is shorter than n
+                hyp_counts[n - 1] += sum(hyp_ngrams.values())
+            ref_counts[n - 1] += sum(ref_ngrams.values())
+    orders = (hyp_counts > 0) & (ref_counts > 0)
+    if not orders.any():
+        return 0.0
+    precision = (matches[orders] / hyp_counts[orders]).mean()
+    recall = (matches[orders] / ref_counts[orders]).mean()
+    if precision + recall == 0:
+        return 0.0
+    return 100 * (1 + beta ** 2) * precision * recall / (beta ** 2 * precision + recall)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('claims')
+    parser.add_argument('--backends', nargs='+', default=['torch', 'onnx'])
+    parser.add_argument('--source-lang', default='de')
+    parser.add_argument('--profiles', action='store_true')
+    parser.add_argument('--references')
+    args = parser.parse_args()
+
+    lines = [line.strip() for line in LineReader().read(args.claims) if line.strip()]
+    references = [line.strip() for line in LineReader().read(args.references)
+                  if line.strip()] if args.references else None
+    word_texts = [line.split(': ', 1) for line in lines if ': ' in line]
+
+    reference = None
+    for backend in args.backends:
+        translator = OpusMTTranslator(source_lang=args.source_lang, backend=backend)
+        start = time.perf_counter()
+        translator.load_model()
+        print(f'{backend}: loaded in {time.perf_counter() - start:.1f} s')
+        translator.translate_text(lines[0])  # warm up
+
+        latencies, outputs = benchmark(translator.translate_text, [(line,) for line in lines])
+        report('translate_text', latencies)
+        if word_texts:
+            report('translate_word_text', benchmark(translator.translate_word_text, word_texts)[0])
+
+        if reference is None:
+            reference = outputs
+        else:
+            same = sum(a == b for a, b in zip(reference, outputs))
+            print(f'  identical translations to {args.backends[0]}: {same}/{len(outputs)}')
+
+        if args.profiles:
+            compare_profiles(translator, lines, references)
+        translator.unload_model()
+
+
+def compare_profiles(translator: OpusMTTranslator, lines: list[str],
+                     references: list[str] | None = None):
+    baseline_latencies, baseline = benchmark(
+        lambda line: translator.get_top_n_translations([line], num_translations=1,
+                                                       num_beams=20)[0][0],
+        [(line,) for line in lines])
+    references = references or baseline
+    rows = [('20 beams (baseline)', baseline_latencies, baseline)]
+    for profile in translator.PROFILES:
+        latencies, outputs = benchmark(lambda line: translator.translate_text(line, profile),
+                                       [(line,) for line in lines])
+        rows.append((f'{profile} {translator.PROFILES[profile]}', latencies, outputs))
+
+    print('  | profile | mean ms | p95 ms | identical to baseline | chrF |')
+    print('  |---|---|---|---|---|')
+    for name, latencies, outputs in rows:
+        latencies = np.array(latencies) * 1000
+        same = sum(a == b for a, b in zip(baseline, outputs))
+        print(f'  | {name} | {latencies.mean():.1f} | {np.quantile(latencies, 0.95):.1f} | '
+              f'{same}/{len(outputs)} | {chrf(outputs, references):.1f} |')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""Evaluates the lexical prefilter of the ModelEvidenceSelector against the full path.
+
+For every claim of the evaluation set, the sentences selected without prefilter are compared to
+  - the sentences surviving the prefilter (candidate recall@N) and
+  - the sentences selected with the prefilter (selection recall@N).
+
+The evaluation set is a .jsonl file with one entry per line containing 'claim' and either
+'evidences' ([{'title', 'line_indices', 'lines'}]) or 'word' to fetch them from Wikipedia.
+Storing the evidences in the file keeps the evaluation fixed.
+
+The results are printed as a markdown table, followed by the smallest N whose selection recall
+reaches --target-recall. The prefilter stays off by default (prefilter_top_n=None) until this
+evaluation has been run, its results recorded and N chosen from them.
+
+Run from the project root:
+python -m scripts.evaluate_prefilter eval_set.jsonl --top-n 10 20 50 100
+"""
+import argparse
+import time
+
+import numpy as np
+
+from app.core.factVerification.pipeline_modules.evidence_fetcher import WikipediaEvidenceFetcher
+from app.core.factVerification.pipeline_modules.evidence_selector import ModelEvidenceSelector
+from app.core.utils.reader import JSONLineReader
+
+
+def selected_keys(selected: list[dict]) -> set[tuple]:
+    return {(entry['title'], entry['line_idx']) for entry in selected}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('eval_set')
+    parser.add_argument('--top-n', type=int, nargs='+', default=[10, 20, 50, 100])
+    parser.add_argument('--max-evidence-count', type=int, default=3)
+    parser.add_argument('--target-recall', type=float, default=0.95)
+    args = parser.parse_args()
+
+    dataset = JSONLineReader().read(args.eval_set)
+    fetcher = None
+    for entry in dataset:
+        if 'evidences' not in entry:
+            fetcher = fetcher or WikipediaEvidenceFetcher()
+            _, entry['evidences'] = fetcher.fetch_evidences(entry['word'], entry['word'],
+                                                            word_lang='en')
+
+    selector = ModelEvidenceSelector()
+    selector.load_model()
+
+    start = time.perf_counter()
+    full = [selector.select_evidences({'text': entry['claim']}, entry['evidences'])
+            for entry in dataset]
+    full_time = time.perf_counter() - start
+    print(f'full path: {full_time / len(dataset) * 1000:.1f} ms per claim')
+    print('| N | candidate recall | selection recall | ms per claim |')
+    print('|---|---|---|---|')
+
+    chosen = None
+    for top_n in sorted(args.top_n):
+        selector.prefilter_top_n = top_n
+        candidate_recalls, selection_recalls, elapsed = [], [], 0
+        for entry, full_selected in zip(dataset, full):
+            claim = {'text': entry['claim']}
+            start = time.perf_counter()
+            selected = selector.select_evidences(claim, entry['evidences'])
+            elapsed += time.perf_counter() - start
+            reference = selected_keys(full_selected)
+            if not reference:
+                continue
+
+            ranked = selector._rank_evidences([claim], [entry['evidences']],
+                                              args.max_evidence_count)[0]
+            candidates = {(evidence['title'], line_idx) for evidence in
+                          selector.prefilter_evidences(entry['claim'], ranked, top_n)
+                          for line_idx in evidence['line_indices']}
+            candidate_recalls.append(len(reference & candidates) / len(reference))
+            selection_recalls.append(len(reference & selected_keys(selected)) / len(reference))
+
+        selection_recall = np.mean(selection_recalls)
+        print(f'| {top_n} | {np.mean(candidate_recalls):.3f} | {selection_recall:.3f} | '
+              f'{elapsed / len(dataset) * 1000:.1f} |')
+        if chosen is None and selection_recall >= args.target_recall:
+            chosen = top_n
+
+    if chosen is None:
+        print(f'No N reaches a selection recall of {args.target_recall}, keep the prefilter off.')
+    else:
+        print(f'Smallest N with a selection recall of at least {args.target_recall}: {chosen}')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,32 @@
+"""Exports a Helsinki-NLP/opus-mt model to onnx for OpusMTTranslator(backend='onnx').
+
+The encoder and the decoder (with past key values, so previously generated tokens are not
+recomputed in every generation step) are exported into onnx_models/opus-mt-{src}-{dest}.
+
+Run from the project root: python -m scripts.export_translation_model --source-lang de
+"""
+import argparse
+
+from optimum.onnxruntime import ORTModelForSeq2SeqLM
+from transformers import AutoTokenizer
+
+from config import PROJECT_DIR
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--source-lang', default='de')
+    parser.add_argument('--dest-lang', default='en')
+    args = parser.parse_args()
+
+    model_name = f'Helsinki-NLP/opus-mt-{args.source_lang}-{args.dest_lang}'
+    output_dir = PROJECT_DIR / 'onnx_models' / f'opus-mt-{args.source_lang}-{args.dest_lang}'
+
+    model = ORTModelForSeq2SeqLM.from_pretrained(model_name, export=True, use_cache=True)
+    model.save_pretrained(output_dir)
+    AutoTokenizer.from_pretrained(model_name).save_pretrained(output_dir)
+    print(f"Model successfully exported to {output_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""Checks timeouts, retries, hedging and rate limiting of the ApiClient against a local stand-in for the
+MediaWiki api that injects delays and errors.
+
+Run from the project root: python -m scripts.test_api_client
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from app.core.factVerification.fetchers.api_client import ApiClient
+from app.core.factVerification.fetchers.rate_limiter import AdaptiveRateLimiter
+
+
+class FaultInjectingHandler(BaseHTTPRequestHandler):
+    """Answers like the api, but the first `fail` calls of a `key` are delayed by `delay`
+    seconds, answered with `status` or throttled for `retry_after` seconds."""
+
+    calls = {}
+    lock = threading.Lock()
+
+    def do_GET(self):
+        query = {key: values[0] for key, values in parse_qs(urlparse(self.path).query).items()}
+        key = query.get('key', '')
+        with self.lock:
+            call = self.calls[key] = self.calls.get(key, 0) + 1
+
+        headers = {'Content-Type': 'application/json'}
+        if call <= int(query.get('fail', 0)):
+            time.sleep(float(query.get('delay', 0)))
+            status = int(query.get('status', 200))
+            if 'retry_after' in query:
+                headers['Retry-After'] = query['retry_after']
+        else:
+            status = 200
+
+        body = json.dumps({'call': call}).encode()
+        try:
+            self.send_response(status)
+            for header, value in headers.items():
+                self.send_header(header, value)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except BrokenPipeError:
+            pass  # the client gave up on this call (timeout)
+
+    def log_message(self, *args):
+        pass
+
+
+def main():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FaultInjectingHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_port}/w/api.php'
+
+    # timeout on the first call, the retry succeeds
+    client = ApiClient(timeout=0.2, max_retries=2, backoff_base=0.01)
+    response = client.get(url, {'key': 'timeout', 'fail': 1, 'delay': 1})
+    metrics = client.metrics()
+    assert response.json()['call'] == 2, response.json()
+    assert metrics['timeouts'] == 1 and metrics['retries'] == 1, metrics
+    print('timeout + retry:', metrics)
+
+    # two 503 responses, the third call succeeds
+    client = ApiClient(timeout=1, max_retries=2, backoff_base=0.01)
+    response = client.get(url, {'key': '503', 'fail': 2, 'status': 503})
+    metrics = client.metrics()
+    assert response.status_code == 200 and response.json()['call'] == 3, response.json()
+    assert metrics['retries'] == 2, metrics
+    print('503 + retries:', metrics)
+
+    # retries exhausted, the last response is returned
+    client = ApiClient(timeout=1, max_retries=1, backoff_base=0.01)
+    response = client.get(url, {'key': '503-exhausted', 'fail': 5, 'status': 503})
+    assert response.status_code == 503
+    print('503 + retries exhausted:', client.metrics())
+
+    # hedging: after warming up the latency estimate, a slow request is hedged
+    client = ApiClient(timeout=5, hedge=True, hedge_min_samples=20)
+    for i in range(20):
+        client.get(url, {'key': f'warmup-{i}'})
+    start = time.perf_counter()
+    response = client.get(url, {'key': 'slow', 'fail': 1, 'delay': 1})
+    elapsed = time.perf_counter() - start
+    metrics = client.metrics()
+    assert response.json()['call'] == 2, response.json()
+    assert metrics['hedged'] == 1 and metrics['hedge_wins'] == 1, metrics
+    assert elapsed < 0.5, elapsed
+    print(f'hedged request answered after {elapsed * 1000:.1f} ms:', metrics)
+
+    # throttling: Retry-After is honored and the rate is decreased
+    limiter = AdaptiveRateLimiter(rate=20)
+    client = ApiClient(timeout=1, backoff_base=0.01, rate_limiter=limiter)
+    start = time.perf_counter()
+    response = client.get(url, {'key': 'throttle', 'fail': 1, 'status': 429,
+                                'retry_after': 0.3})
+    elapsed = time.perf_counter() - start
+    stats = limiter.stats()
+    assert response.status_code == 200 and elapsed >= 0.3, elapsed
+    assert stats['throttled'] == 1 and stats['ceiling'] == 20 and stats['rate'] < 20, stats
+    print(f'throttled request answered after {elapsed * 1000:.1f} ms:', stats)
+
+    # the limiter keeps concurrent callers at its rate
+    limiter = AdaptiveRateLimiter(rate=50, burst=1, increase=0)
+    client = ApiClient(timeout=1, rate_limiter=limiter)
+    start = time.perf_counter()
+    threads = [threading.Thread(target=client.get, args=(url, {'key': f'rate-{i}'}))
+               for i in range(25)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    assert elapsed >= 24 / 50, elapsed
+    print(f'25 requests at 50 requests/s took {elapsed * 1000:.1f} ms:', limiter.stats())
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
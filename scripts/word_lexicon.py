@@ -0,0 +1,99 @@
+"""Builds and benchmarks the local word lexicon used to translate single words.
+
+build: Extracts the (word, english translation) pairs of a language from the translation
+tables of the english Wiktionary, using the wiktextract dump from https://kaikki.org
+(one json entry per line). Existing entries of the lexicon (e.g. resolved interlanguage
+links) are kept.
+
+python -m scripts.word_lexicon build kaikki.org-dictionary-English.jsonl cache/lexicon_de_en.tsv
+
+benchmark: Translates a list of words (one per line, optionally 'word<TAB>expected translation')
+with the lexicon, the interlanguage links and the translation model, and reports coverage,
+accuracy and latency of each path.
+
+python -m scripts.word_lexicon benchmark words.tsv cache/lexicon_de_en.tsv
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from app.core.factVerification.fetchers.wikipedia import Wikipedia
+from app.core.factVerification.fetchers.word_lexicon import WordLexicon
+from app.core.factVerification.pipeline_modules.translator import OpusMTTranslator
+from app.core.utils.reader import LineReader
+
+
+def build(args):
+    lexicon = WordLexicon(args.lexicon, source_lang=args.lang)
+    words_before = len(lexicon)
+    with open(args.dump, 'r', encoding='utf-8') as dump:
+        for line in dump:
+            entry = json.loads(line)
+            if entry.get('lang_code') != 'en':
+                continue
+            for translation in entry.get('translations', []):
+                if translation.get('code') == args.lang and translation.get('word'):
+                    lexicon.add(translation['word'], entry['word'])
+    print(f'{len(lexicon) - words_before} words added, {len(lexicon)} words in {args.lexicon}')
+
+
+def evaluate(name: str, translate, words: list[str], expected: list[str | None]):
+    latencies, translations = [], []
+    for word in words:
+        start = time.perf_counter()
+        translations.append(translate(word))
+        latencies.append(time.perf_counter() - start)
+
+    latencies = np.array(latencies) * 1000
+    covered = [translation for translation in translations if translation]
+    print(f'{name}: coverage {len(covered)}/{len(words)}, '
+          f'mean {latencies.mean():.3f} ms, p95 {np.quantile(latencies, 0.95):.3f} ms')
+    gold = [(translation, target) for translation, target in zip(translations, expected)
+            if target]
+    if gold:
+        correct = sum(bool(translation) and translation.lower() == target.lower()
+                      for translation, target in gold)
+        print(f'  accuracy {correct}/{len(gold)}')
+
+
+def benchmark(args):
+    entries = [line.rstrip('\n').split('\t') for line in LineReader().read(args.words)
+               if line.strip()]
+    words = [entry[0] for entry in entries]
+    expected = [entry[1] if len(entry) > 1 else None for entry in entries]
+
+    lexicon = WordLexicon(args.lexicon, source_lang=args.lang)
+    wiki = Wikipedia()
+    translator = OpusMTTranslator(source_lang=args.lang)
+    translator.load_model()
+
+    evaluate('lexicon', lambda word: next(iter(lexicon.lookup(word)), None), words, expected)
+    evaluate('interlanguage links',
+             lambda word: wiki.get_interlanguage_title(word, source_lang=args.lang),
+             words, expected)
+    evaluate('translation model',
+             lambda word: translator.translate_batch([word], profile='word')[0][0],
+             words, expected)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(required=True)
+    build_parser = subparsers.add_parser('build')
+    build_parser.add_argument('dump')
+    build_parser.add_argument('lexicon')
+    build_parser.add_argument('--lang', default='de')
+    build_parser.set_defaults(func=build)
+    benchmark_parser = subparsers.add_parser('benchmark')
+    benchmark_parser.add_argument('words')
+    benchmark_parser.add_argument('lexicon')
+    benchmark_parser.add_argument('--lang', default='de')
+    benchmark_parser.set_defaults(func=benchmark)
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()